@@ -0,0 +1,360 @@
+'''
+    An asyncio flavoured twin of TS3_API, built on asyncio streams rather than a blocking socket.
+
+    Every command is a coroutine that resolves to the parsed response. Any number of coroutines may share
+    one connection: commands are written to the socket as they are submitted and their futures are queued,
+    while a single reader task resolves the queue in order as responses come back.
+
+'''
+import asyncio
+from collections import deque
+
+from Exceptions   import IllegalStateException, TS3Exception
+from FloodControl import TokenBucket, DEFAULT_FLOOD_COMMANDS, DEFAULT_FLOOD_TIME, FLOOD_ERROR_ID
+from TS3_Codec    import encode, parseMap
+
+class AsyncTS3_API:
+
+    #TS3 has an anti-flood system. Every command waits on flood_control (a FloodControl.TokenBucket, or None when whitelisted) before it is sent.
+    flood_control = None
+    flood_retries = 3 #How many times a command the server rejected for flooding is retried after backing off.
+
+    #Largest single response line we'll accept, asyncio's default of 64KiB is too small for "clientdblist" and the like.
+    read_limit = 2**26
+
+    reader = None
+    writer = None
+    is_Connected = False
+    is_Authenticated = False
+
+    clid = -1 #This ServerQuery instance's client ID.
+    chid = -1 #The ID of the channel this instance currently resides in.
+
+    def __init__(self):
+        self.awaiting = deque()         #Futures of the commands that have been sent, in the order they were sent.
+        self.send_lock = asyncio.Lock() #Puts the commands of coroutines submitting at once on the wire one at a time, in the order flood control paces them.
+        self.flood_control = TokenBucket() #Assume TS3's default limits until told otherwise, see configureFloodControl.
+        self.receiver = None            #The task matching responses to self.awaiting.
+        self.lost = None                #Why the connection was lost, if the reader task found it gone.
+
+    ###############################################################################
+    ##################### Networking/IO Functionalities ###########################
+    ###############################################################################
+
+    async def connect(self, address, port, sid=1):
+        """ Connect to a target TS3 server. """
+
+        (self.reader, self.writer) = await asyncio.open_connection(address, port, limit=self.read_limit)
+
+        if (
+            await self.reader.readuntil(b"\n\r") == b"TS3\n\r" and
+            await self.reader.readuntil(b"\n\r") != b""
+        ):
+            self.is_Connected = True
+            self.lost = None
+            self.receiver = asyncio.create_task(self.receive())
+            await self.changeSID(sid) #Select virtual server
+        else:
+            raise ConnectionError("An unknown connection error occurred and we could not verify a connection to the server. You're likely flood banned or the server is down.")
+
+    async def disconnect(self):
+        """ Disconnect from the current TS3 server and close the connection. """
+
+        if self.lost is not None: #Nothing left to say goodbye to, just tidy up.
+            self.writer.close()
+        elif not self.is_Connected:
+            raise IllegalStateException("Not connected to a server; Cannot disconnect!")
+        else:
+            try: #Attempt to logout
+                await self.logout()
+            except IllegalStateException:
+                pass
+
+            #Close connection
+            await self.submitCommand("quit")
+            self.receiver.cancel()
+            self.writer.close()
+
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass #It's closed either way.
+
+        #Reset internal variables
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        self.lost = None
+        self.is_Connected = False
+        self.is_Authenticated = False
+
+    async def submitCommand(self, command):
+        """
+            Transmits a command to the server and returns its response once it arrives, retrying it whilst the server rejects it for flooding.
+            Safe to call from many coroutines at once; responses are handed back to whoever sent the command.
+            Once the connection has been lost every command raises the ConnectionError that said so, until we connect again.
+        """
+
+        for attempt in range(self.flood_retries + 1):
+            try:
+                return await self.send(command)
+            except TS3Exception as e:
+                if self.flood_control is None or int(e.error_ID) != FLOOD_ERROR_ID or attempt == self.flood_retries:
+                    raise e
+                self.flood_control.backoff(e.extra_msg, attempt) #Slow down and try again.
+
+    async def send(self, command):
+        """ Waits for the flood control's go-ahead, then transmits a command. Returns its response once it arrives. """
+
+        self.checkConnected()
+        future = asyncio.get_running_loop().create_future()
+
+        async with self.send_lock:
+            if self.flood_control is not None:
+                await asyncio.sleep(self.flood_control.reserve())
+
+            self.checkConnected() #The connection may have gone whilst we waited for our turn.
+
+            #Writing and queueing the future happen without yielding, so the queue is always in the order commands hit the wire.
+            self.writer.write((command + "\n\r").encode())
+            self.awaiting.append(future)
+            await self.writer.drain()
+
+        return await future
+
+    def checkConnected(self):
+
+        if self.lost is not None:
+            raise ConnectionError(str(self.lost))
+        if not self.is_Connected:
+            raise IllegalStateException("Not connected to a server; Cannot submit command!")
+
+    async def configureFloodControl(self, whitelisted=False, commands=None, period=None):
+        """
+            Set the rate at which commands are sent, as TS3_API.configureFloodControl does. Whitelisted connections aren't limited at all,
+            otherwise commands commands are allowed per period seconds; either left as None is read from the server's "instanceinfo".
+        """
+
+        if whitelisted:
+            self.flood_control = None
+            return
+
+        if commands is None or period is None:
+            try:
+                instance_info = await self.submitCommand("instanceinfo") or {}
+            except TS3Exception: #Most likely insufficient permissions.
+                instance_info = {}
+
+            commands = commands or int(instance_info.get("serverinstance_serverquery_flood_commands", DEFAULT_FLOOD_COMMANDS))
+            period = period or int(instance_info.get("serverinstance_serverquery_flood_time", DEFAULT_FLOOD_TIME))
+
+        self.flood_control = TokenBucket(commands, period).takeOver(self.flood_control) #What we've just sent still counts.
+
+    async def submitCommands(self, commands):
+        """ Submit several commands at once. Returns a list holding either each command's response or the exception it raised. """
+        return await asyncio.gather(*[self.submitCommand(command) for command in commands], return_exceptions=True)
+
+    async def receive(self):
+        """ Reader task. Matches each response coming off the socket to the oldest command still awaiting one. """
+
+        try:
+            while True:
+                try:
+                    result = await self.getResponse()
+                except TS3Exception as e:
+                    self.resolve(exception=e)
+                else:
+                    self.resolve(result=result)
+
+        except Exception as e: #The connection went away (or is hopelessly out of step), nothing still waiting or yet to be sent will ever be answered.
+            self.lost = ConnectionError("The connection to the server was lost (" + str(e) + ").")
+            self.is_Connected = False
+            self.is_Authenticated = False
+            while self.awaiting:
+                self.resolve(exception=self.lost)
+
+    def resolve(self, result=None, exception=None):
+        """ Hand a result or exception to the oldest command awaiting a response. """
+
+        future = self.awaiting.popleft()
+
+        if future.cancelled(): #Whoever sent it stopped waiting; the response is simply dropped.
+            return
+
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def getResponse(self):
+        """ Listens for and returns a response from the server after a command is executed. """
+
+        raw_response = (await self.reader.readuntil(b"\n\r")).decode().strip() #Collect from pipe until terminating character is read.
+
+        #Check for OK response from pipe.
+        if raw_response[:5] == "error":
+            error_report = parseMap(raw_response[6:])  #Retrieve the error and parse it
+            if error_report["id"] != "0":              #If it was not an OK response...
+                raise TS3Exception(error_report["msg"], error_report["id"], error_report.get("extra_msg")) #...raise it as an exception to the calling function.
+            return None #Otherwise just ignore it.
+
+        values = [parseMap(x) for x in raw_response.split('|')] #Parse all elements of the list
+        await self.getResponse() #Purge OK response from pipe
+
+        return values if len(values) > 1 else values[0] #Lists of one are returned as just the map, as TS3_API does.
+
+    ###############################################################################
+    ############################ Server Query Commands ############################
+    ###############################################################################
+
+    async def login(self, username, password, nickname=None):
+        """ Raise privledges and permission values by logining into a ServerQuery account. """
+
+        if not self.is_Connected:
+            raise IllegalStateException("Not connected to a server; Cannot login!")
+
+        await self.submitCommand("login " + encode(username) + " " + encode(password)) #Authenticate
+        await self.submitCommand("clientupdate client_nickname=" + encode(nickname if nickname is not None else username)) #Change nickname to username.
+
+        #Update meta-data
+        wai = await self.submitCommand("whoami")
+        (self.clid, self.chid) = (wai['client_id'], wai['client_channel_id'])
+        self.is_Authenticated = True
+
+    async def logout(self):
+        """ Logout and return to the default ServerQuery user group. """
+
+        if not self.is_Authenticated:
+            raise IllegalStateException("Not logged in; Cannot logout!")
+
+        await self.submitCommand("logout")
+        self.is_Authenticated = False
+
+    async def changeSID(self, sid):
+        """ Change what virtual server the ServerQuery instance is operating on. """
+        await self.submitCommand("use sid=" + str(sid))
+
+    async def getServerInfo(self):
+        return await self.submitCommand("serverinfo")
+
+    async def getServerList(self):
+        return await self.submitCommand("serverlist")
+
+    async def getChannelList(self):
+        return await self.submitCommand("channellist")
+
+    async def getChannelInfo(self, channelID):
+        return await self.submitCommand("channelinfo cid=" + str(channelID))
+
+    async def moveChannel(self, targetChannelID, parentChannelID, orderID=None):
+        return await self.submitCommand("channelmove cid=" + str(targetChannelID) + " cpid=" + str(parentChannelID) + (" order=" + str(orderID) if orderID is not None else ""))
+
+    async def deleteChannel(self, channelID, force=True):
+        return await self.submitCommand("channeldelete cid=" + str(channelID) + " force=" + ("1" if force else "0"))
+
+    async def getChannelGroups(self):
+        return await self.submitCommand("channelgrouplist")
+
+    async def getChannelGroupMembers(self, channelGroupID):
+        return await self.submitCommand("channelgroupclientlist cgid=" + str(channelGroupID))
+
+    async def getClientsChannelGroups(self, clientDBID):
+        return await self.submitCommand("channelgroupclientlist cldbid=" + str(clientDBID))
+
+    async def getClientInfo(self, clientID):
+        """ Get a far more detailed list of meta-data than what is provided by "clientlist". """
+        return await self.submitCommand("clientinfo clid=" + str(clientID))
+
+    async def setChannelGroup(self, clientDBID, channelGroupID, channelID):
+        return await self.submitCommand("setclientchannelgroup cldbid=" + str(clientDBID) + " cid=" + str(channelID) + " cgid=" + str(channelGroupID))
+
+    async def getConnectedClients(self, detailed=False):
+        """ Request a list of the clients currently connected to the server. Set detailed to True if you require more detailed information than what TS3's "clientlist" command provides. """
+
+        clients = await self.submitCommand("clientlist")
+        if isinstance(clients, dict): #Just the one client (probably us).
+            clients = [clients]
+
+        if detailed: #Every "clientinfo" goes out at once, their responses are matched up as they arrive.
+
+            infos = await self.submitCommands(["clientinfo clid=" + str(client["clid"]) for client in clients])
+            connected = []
+
+            for (client, info) in zip(clients, infos):
+                if isinstance(info, TS3Exception):
+                    if int(info.error_ID) == 512: #512 is "client could not be targeted", IE. they logged out.
+                        continue
+                    raise info
+                elif isinstance(info, Exception):
+                    raise info
+                client.update(info)
+                connected.append(client)
+
+            clients = connected
+
+        return clients
+
+    async def getAllClients(self):
+        """ Requests a list of EVERY client (incl. offline ones) from the database. """
+        return await self.submitCommand("clientdblist")
+
+    async def getClientServerGroups(self, clientDBID):
+        return await self.submitCommand("servergroupsbyclientid cldbid=" + str(clientDBID))
+
+    async def kick(self, clientID, reason, fromServer):
+
+        if len(reason) > 40:
+            raise ValueError("The reason for a kick can be no greater than 40 characters. Your message was:\"" + reason + "\" w/ " + str(len(reason)) + " characters.")
+
+        return await self.submitCommand("clientkick clid=" + str(clientID) + " reasonid=" + ("5" if fromServer else "4") + " reasonmsg=" + encode(reason))
+
+    async def banClient(self, clientID, time=0, reason=""):
+
+        if len(reason) > 40:
+            raise ValueError("The reason for a ban can be no greater than 40 characters. Your message was:\"" + reason + "\".")
+
+        return await self.submitCommand("banclient clid=" + str(clientID) + (" time=" + str(time) if time > 0 else "") + (" banreason=" + encode(reason) if reason != "" else ""))
+
+    async def moveClient(self, clientID, channelID):
+        return await self.submitCommand("clientmove clid=" + str(clientID) + " cid=" + str(channelID))
+
+    async def pokeClient(self, clientID, message):
+        return await self.submitCommand("clientpoke clid=" + str(clientID) + " msg=" + encode(message))
+
+    async def messageClient(self, clientID, message):
+        return await self.message(clientID, 1, message)
+
+    async def messageChannel(self, channelID, message):
+
+        if self.chid != channelID:
+            await self.moveClient(self.clid, channelID) #Need to be in the channel to message it...
+            self.chid = channelID
+
+        return await self.message(channelID, 2, message)
+
+    async def messageServer(self, serverID, message):
+        return await self.message(serverID, 3, message)
+
+    async def message(self, targetID, targetMode, message):
+        return await self.submitCommand("sendtextmessage targetmode=" + str(targetMode) + " target=" + str(targetID) + " msg=" + encode(message))
+
+    async def offlineMessageClient(self, clientUID, subject, message):
+        return await self.submitCommand("messageadd cluid=" + str(clientUID) + " subject=" + encode(subject) + " message=" + encode(message))
+
+    async def changeDisplayName(self, name):
+        return await self.submitCommand("clientupdate client_nickname=" + encode(name))
+
+    async def globalMessage(self, message):
+        return await self.submitCommand("gm msg=" + encode(message))
+
+    async def getServerGroups(self):
+        return await self.submitCommand("servergrouplist")
+
+    async def getServerGroupMembers(self, serverGroupID):
+        return await self.submitCommand("servergroupclientlist sgid=" + str(serverGroupID))
+
+    async def addClientToServerGroup(self, clientDBID, serverGroupID):
+        return await self.submitCommand("servergroupaddclient sgid=" + str(serverGroupID) + " cldbid=" + str(clientDBID))
+
+    async def removeClientFromServerGroup(self, clientDBID, serverGroupID):
+        return await self.submitCommand("servergroupdelclient sgid=" + str(serverGroupID) + " cldbid=" + str(clientDBID))
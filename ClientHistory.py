@@ -0,0 +1,156 @@
+'''
+    A local SQLite record of who was connected to our servers and how full they were, run after run.
+
+    Every run adds a row to "runs" (when, which server, its occupancy) and a compact row per connected client to "snapshots",
+    all in one transaction. The helpers below answer questions about the past, IE. a client's hours online over the last month
+    or the server's busiest hours, from the database rather than by scanning "clientdblist" on the server.
+
+    A client counts as online for the time from a run they appear in to the next run of that server, capped at max_gap seconds
+    so a missed run (or the bot not running overnight) isn't taken as everybody having stayed connected.
+
+'''
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id              INTEGER PRIMARY KEY,
+        instance        TEXT NOT NULL,      -- "address:port" of the TS3 instance.
+        sid             INTEGER NOT NULL,   -- Virtual server ID.
+        time            INTEGER NOT NULL,   -- Unix time.
+        clients_online  INTEGER NOT NULL,
+        max_clients     INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS runs_by_server_time ON runs (instance, sid, time);
+
+    CREATE TABLE IF NOT EXISTS snapshots (
+        run                 INTEGER NOT NULL REFERENCES runs (id),
+        time                INTEGER NOT NULL, -- The run's, repeated so a client's history is one index range.
+        client_database_id  INTEGER NOT NULL,
+        channel             INTEGER,
+        idle_time           INTEGER,          -- Milliseconds.
+        connected_time      INTEGER,          -- Milliseconds, NULL unless it was fetched that run.
+        away                INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS snapshots_by_client_time ON snapshots (client_database_id, time);
+    CREATE INDEX IF NOT EXISTS snapshots_by_run ON snapshots (run);
+"""
+
+#Each run of a server and the seconds until its next run, capped at max_gap. The latest run's lasts until now, capped the same.
+RUN_SPANS = """
+    SELECT id, time, clients_online, max_clients, MAX(MIN(COALESCE(LEAD(time) OVER (ORDER BY time), :now) - time, :max_gap), 0) AS span
+    FROM runs WHERE instance = :instance AND sid = :sid AND time >= :since
+"""
+
+def toInt(value):
+    """ A client field as an int, whether typed or the server's string, or None if it's missing. """
+
+    return int(value) if value is not None and value != "" else None
+
+class ClientHistory(object):
+
+    max_gap = 3600 #Longest span between runs a client is counted as online for, in seconds.
+
+    def __init__(self, path):
+        """ Open (or create) the history database at path; ":memory:" for one that's thrown away. """
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock() #One writer at a time, IE. an Orchestrator recording several servers at once.
+
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, instance, sid, server_info, clients, when=None):
+        """ Store a run: the server's occupancy and a snapshot of each of the clients (as getConnectedClients returns them) in one transaction. Returns the number of clients stored. """
+
+        when = int(when if when is not None else time.time())
+
+        rows = [(
+            toInt(client.get("client_database_id")), toInt(client.get("cid")), toInt(client.get("client_idle_time")),
+            toInt(client.get("connection_connected_time")), 1 if client.get("client_away") in (True, "1") else 0
+        ) for client in clients if toInt(client.get("client_type")) != 1] #Query clients, us included, aren't worth remembering.
+
+        with self.lock, self.db:
+            run = self.db.execute(
+                "INSERT INTO runs (instance, sid, time, clients_online, max_clients) VALUES (?, ?, ?, ?, ?)",
+                (instance, int(sid), when, toInt(server_info["virtualserver_clientsonline"]), toInt(server_info["virtualserver_maxclients"]))
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO snapshots (run, time, client_database_id, channel, idle_time, connected_time, away) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run, when) + row for row in rows]
+            )
+
+        return len(rows)
+
+    def prune(self, days):
+        """ Forget runs older than days. """
+
+        since = int(time.time() - days * 86400)
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM snapshots WHERE run IN (SELECT id FROM runs WHERE time < ?)", (since,))
+            self.db.execute("DELETE FROM runs WHERE time < ?", (since,))
+
+    def query(self, sql, parameters):
+        with self.lock:
+            return self.db.execute(sql, parameters).fetchall()
+
+    ###############################################################################
+    ################################### Queries ###################################
+    ###############################################################################
+
+    def hoursOnline(self, instance, sid, days=30):
+        """ Client database ID -> hours connected to the server over the last days, for everyone seen in that time. """
+
+        now = time.time()
+        rows = self.query(
+            "WITH spans AS (" + RUN_SPANS + ") SELECT client_database_id, SUM(span) FROM snapshots JOIN spans ON snapshots.run = spans.id GROUP BY client_database_id",
+            {"instance": instance, "sid": int(sid), "since": int(now - days * 86400), "max_gap": self.max_gap, "now": int(now)}
+        )
+        return dict((cldbid, seconds / 3600.0) for (cldbid, seconds) in rows)
+
+    def clientHoursOnline(self, instance, sid, cldbid, days=30):
+        """ Hours a client was connected to the server over the last days. """
+
+        now = time.time()
+        (seconds,) = self.query(
+            "WITH spans AS (" + RUN_SPANS + ") SELECT COALESCE(SUM(span), 0) FROM snapshots JOIN spans ON snapshots.run = spans.id " +
+            "WHERE client_database_id = :cldbid",
+            {"instance": instance, "sid": int(sid), "since": int(now - days * 86400), "max_gap": self.max_gap, "now": int(now), "cldbid": int(cldbid)}
+        )[0]
+        return seconds / 3600.0
+
+    def lastSeen(self, instance, sid, cldbids):
+        """ Client database ID -> Unix time they were last seen connected, for those of cldbids that ever were. """
+
+        cldbids = [int(x) for x in cldbids]
+        rows = []
+        for i in range(0, len(cldbids), 500): #SQLite limits how many parameters a statement may have.
+            chunk = cldbids[i:i + 500]
+            rows += self.query(
+                "SELECT client_database_id, MAX(snapshots.time) FROM snapshots JOIN runs ON snapshots.run = runs.id " +
+                "WHERE instance = ? AND sid = ? AND client_database_id IN (" + ",".join("?" * len(chunk)) + ") GROUP BY client_database_id",
+                [instance, int(sid)] + chunk
+            )
+        return dict(rows)
+
+    def peakSlotsByHour(self, instance, sid, days=30):
+        """ Hour of the day (0-23, local time) -> (most clients online, average clients online, slots) over the last days. Hours without runs are left out. """
+
+        rows = self.query(
+            "SELECT CAST(strftime('%H', time, 'unixepoch', 'localtime') AS INTEGER) AS hour, MAX(clients_online), AVG(clients_online), MAX(max_clients) " +
+            "FROM runs WHERE instance = ? AND sid = ? AND time >= ? GROUP BY hour ORDER BY hour",
+            (instance, int(sid), int(time.time() - days * 86400))
+        )
+        return dict((hour, (peak, average, slots)) for (hour, peak, average, slots) in rows)
+
+    def occupancy(self, instance, sid, days=30):
+        """ (Unix time, clients online, slots) of each run over the last days, oldest first. """
+
+        return self.query(
+            "SELECT time, clients_online, max_clients FROM runs WHERE instance = ? AND sid = ? AND time >= ? ORDER BY time",
+            (instance, int(sid), int(time.time() - days * 86400))
+        )
@@ -0,0 +1,151 @@
+'''
+    Long running mode for the bot.
+
+    Rather than connecting, sweeping every client and quitting each time it is run, the daemon stays connected,
+    keeps a table of connected clients up to date from the server's notifications and runs its policies over that
+    table on a schedule. Each run then costs a single "clientlist" plus a "clientinfo" for each newly arrived client.
+
+'''
+import time
+
+from Exceptions import TS3Exception
+from TS3_API    import CONNECTION_ERRORS
+
+class TS3_Daemon(object):
+
+    #One request fetches the idle times, groups, platforms etc. of everybody. The rest comes from notifications or "clientinfo".
+    CLIENT_LIST_COMMAND = "clientlist -uid -away -voice -times -groups -info"
+
+    STOP_CHECK = 1.0 #Longest we wait on notifications before checking whether we've been stopped, in seconds.
+
+    def __init__(self, api, policies, interval=300, logger=None):
+        """
+            api is a connected and logged in TS3_API.
+            policies is a list of functions taking (server_info, connected_clients), the same arguments as Main's, run every interval seconds.
+        """
+
+        self.api = api
+        self.policies = policies
+        self.interval = interval
+        self.logger = logger
+
+        self.clients = {}         #clid -> client dictionary (or TS3_Records.Client if the api is typed), as getConnectedClients(detailed=True) would give.
+        self.connected_since = {} #clid -> time the client connected, for working out "connection_connected_time" ourselves.
+        self.unseen = set()       #clids that still need a "clientinfo" for the details the client list lacks.
+        self.running = False
+
+    def log(self, line):
+        if self.logger is not None:
+            self.logger.log(line)
+
+    def run(self):
+        """
+            Register for notifications and then process them and run the policies on schedule until stop() is called.
+            We only stop between policy runs and polls, so stop() is safe to call from a signal handler: the connection is left ready for its next command.
+        """
+
+        self.api.registerNotifications("server")     #Clients connecting and disconnecting.
+        self.api.registerNotifications("channel", 0) #Clients moving between any channels.
+        self.running = True
+
+        next_run = time.monotonic()
+
+        while self.running:
+
+            if time.monotonic() >= next_run:
+                self.runPolicies()
+                next_run = time.monotonic() + self.interval
+                continue #In case we were stopped during the run.
+
+            try:
+                events = self.api.pollNotifications(min(max(next_run - time.monotonic(), 0), self.STOP_CHECK))
+            except CONNECTION_ERRORS as e: #Couldn't reconnect. The server may be back by the next try.
+                self.log("Lost the connection to the server (" + str(e) + ")")
+                time.sleep(self.STOP_CHECK)
+                continue
+
+            for (event, data) in events:
+                try:
+                    self.handleNotification(event, data)
+                except (KeyError, TypeError, ValueError) as e: #A notification we don't understand shouldn't stop the daemon. The next client list puts the table right.
+                    self.log("Skipping notification \"" + event + "\" (" + repr(e) + ")")
+
+    def stop(self):
+        self.running = False
+
+    def handleNotification(self, event, data):
+        """ Apply a notification to the client table. """
+
+        if event == "notifycliententerview":
+            clid = data["clid"]
+            self.clients[clid] = data
+            self.connected_since[clid] = time.time()
+            self.unseen.add(clid)
+
+        elif event == "notifyclientleftview":
+            self.forget(data["clid"])
+
+        elif event == "notifyclientmoved":
+            if data["clid"] in self.clients:
+                self.clients[data["clid"]]["cid"] = data["ctid"]
+
+    def forget(self, clid):
+        self.clients.pop(clid, None)
+        self.connected_since.pop(clid, None)
+        self.unseen.discard(clid)
+
+    def refresh(self):
+        """ Bring the client table up to date: idle times and the like from one client list, and the full details of any client we've not seen before. """
+
+        listed = dict((client["clid"], client) for client in self.api.submitCommandIter(self.CLIENT_LIST_COMMAND))
+
+        #The list is authoritative, in case we've missed any notifications.
+        for clid in [clid for clid in self.clients if clid not in listed]:
+            self.forget(clid)
+
+        for (clid, client) in listed.items():
+            if clid in self.clients:
+                self.clients[clid].update(client)
+            else:
+                self.clients[clid] = client
+                self.unseen.add(clid)
+
+        unseen = list(self.unseen)
+        for (clid, info) in zip(unseen, self.api.submitCommands(["clientinfo clid=" + str(clid) for clid in unseen])):
+
+            if isinstance(info, TS3Exception):
+                if int(info.error_ID) == 512: #512 is "client could not be targeted", IE. they've just left.
+                    self.forget(clid)
+                    continue
+                raise info
+
+            self.clients[clid].update(info)
+            if clid not in self.connected_since: #Already connected when we started.
+                self.connected_since[clid] = time.time() - int(info["connection_connected_time"]) / 1000.0
+
+        self.unseen.clear()
+
+        now = time.time()
+        for (clid, client) in self.clients.items():
+            connected_time = int((now - self.connected_since[clid]) * 1000)
+            client["connection_connected_time"] = connected_time if self.api.typed else str(connected_time)
+
+    def runPolicies(self):
+        """ Refresh the client table and run every policy over it. A connection going wrong is logged and the run given up on, the next is on schedule as usual. """
+
+        try:
+            if not self.api.is_Connected: #The server was away when we last tried to reconnect.
+                self.api.reconnect()
+            self.refresh()
+            server_info = self.api.getServerInfo()
+        except CONNECTION_ERRORS as e:
+            self.log("Could not refresh the client list, skipping this run (" + str(e) + ")")
+            return
+
+        for policy in self.policies:
+            try:
+                policy(server_info, [client.copy() for client in self.clients.values()]) #Copies, so a policy can't corrupt the table.
+            except TS3Exception as e:
+                self.log("Policy \"" + policy.__name__ + "\" failed (" + str(e) + ")")
+            except CONNECTION_ERRORS as e: #IE. a kick that may or may not have happened. We've reconnected if we could, the next policy can try.
+                self.log("Policy \"" + policy.__name__ + "\" lost the connection (" + str(e) + ")")
@@ -18,7 +18,9 @@ class TS3Exception(Exception):
     TS3 threw an exception, so I'm throwing it to you...
     '''
     error_ID = -1
+    extra_msg = None #Some errors come with further detail, IE. how long to wait when flooding.
 
-    def __init__(self, message, error_ID):
-        self.errorID = error_ID
+    def __init__(self, message, error_ID, extra_msg=None):
+        self.error_ID = self.errorID = error_ID
+        self.extra_msg = extra_msg
         super(Exception, self).__init__(message)
@@ -0,0 +1,97 @@
+'''
+    Client side flood control for ServerQuery connections.
+
+    TS3 bans any query client that sends more than serverinstance_serverquery_flood_commands commands within
+    serverinstance_serverquery_flood_time seconds (10 per 3 seconds by default) unless its IP is whitelisted.
+    A token bucket lets us burst a few commands and then paces us just under the server's limit, rather than
+    sleeping a fixed amount before every command.
+
+'''
+import re
+import threading
+import time
+
+DEFAULT_FLOOD_COMMANDS = 10 #TS3's defaults for serverinstance_serverquery_flood_commands...
+DEFAULT_FLOOD_TIME = 3      #...and serverinstance_serverquery_flood_time.
+
+FLOOD_ERROR_ID = 524 #"client is flooding"
+
+class TokenBucket(object):
+    """
+        Keeps us within commands commands per period seconds. Allows bursts of up to burst commands (a quarter of the limit by default),
+        refilling at (commands - burst)/period per second so that no period can ever see more than commands commands.
+        When the server still reports flooding the refill rate is halved, then recovers gradually as commands go through.
+    """
+
+    def __init__(self, commands=DEFAULT_FLOOD_COMMANDS, period=DEFAULT_FLOOD_TIME, burst=None):
+
+        if burst is None:
+            burst = max(1, commands // 4)
+        burst = min(burst, commands - 1) if commands > 1 else 1
+
+        self.capacity = float(burst)
+        self.base_rate = max(commands - burst, 1) / float(period) #Tokens regained per second when all is well.
+        self.rate = self.base_rate
+
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.blocked_until = 0 #Set by backoff(); nothing goes out before then.
+
+        self.lock = threading.Lock()
+
+    def takeOver(self, previous):
+        """ Carry on from where the bucket previous left off, so the commands it let through recently still count against us. Returns self. """
+
+        if previous is not None:
+            with previous.lock:
+                previous.refill(time.monotonic())
+                self.tokens = min(self.capacity, previous.tokens)
+                self.last = previous.last
+                self.blocked_until = previous.blocked_until
+
+        return self
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """ Blocks until a command may be sent, then spends a token on it. Returns the time spent waiting in seconds. """
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self):
+        """
+            acquire() for callers that mustn't block, IE. coroutines: spends a token straight away and returns how many seconds to wait before sending.
+            A token not yet refilled is borrowed, leaving the bucket in debt, so whoever reserves next waits their turn behind us.
+        """
+
+        with self.lock:
+
+            now = time.monotonic()
+            self.refill(now)
+
+            wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+
+            self.tokens -= 1
+            self.rate = min(self.base_rate, self.rate * 1.05) #Every command that gets this far nudges the rate back towards normal.
+
+            return wait
+
+    def backoff(self, extra_msg=None, attempt=0):
+        """
+            Called when the server reports flooding despite our pacing. Empties the bucket, halves the refill rate and
+            holds off all commands for as long as the server asked (its extra_msg reads "please wait N seconds"),
+            or exponentially longer with each failed attempt if it didn't say.
+        """
+
+        match = re.search(r"(\d+)\s*second", extra_msg or "")
+        delay = int(match.group(1)) if match else (2 ** attempt)
+
+        with self.lock:
+            self.tokens = 0
+            self.rate = max(self.rate / 2, self.base_rate / 16)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
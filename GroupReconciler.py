@@ -0,0 +1,126 @@
+'''
+    Works out the server groups every client should be in, in one pass, and brings the server in line with as few commands as possible.
+
+    The rules are those of Main.manageUsersGroups:
+        1. A client belongs to only their highest ranked group (the lowest "sortid"), every other membership is removed.
+        2. A client only in the default group with more than PROMOTION_CONNECTIONS connections is promoted to the lowest ranked group above it.
+
+    Rather than a command per membership change, the changes are collected per group and sent as "servergroupaddclient"/"servergroupdelclient"
+    commands naming many clients at once ("cldbid=1|cldbid=2|...").
+
+'''
+from Exceptions  import TS3Exception
+from TS3_Records import serverGroupsOf
+
+class GroupPlan(object):
+    """ The membership changes a GroupReconciler wants made. adds and removes map a group ID to {client database ID: client}. """
+
+    def __init__(self, groups):
+        self.groups = groups #sgid -> server group, for naming them in the report.
+        self.adds = {}
+        self.removes = {}
+
+    def __len__(self):
+        return sum(len(x) for x in self.adds.values()) + sum(len(x) for x in self.removes.values())
+
+    def add(self, sgid, cldbid, client):
+        self.adds.setdefault(sgid, {})[cldbid] = client
+
+    def remove(self, sgid, cldbid, client):
+        self.removes.setdefault(sgid, {})[cldbid] = client
+
+    def commands(self, batch_size=100):
+        """ The commands carrying out the plan; one per group (per batch_size clients), removals first. """
+
+        commands = []
+        for (verb, changes) in (("servergroupdelclient", self.removes), ("servergroupaddclient", self.adds)):
+            for (sgid, clients) in sorted(changes.items()):
+                cldbids = sorted(clients)
+                for i in range(0, len(cldbids), batch_size):
+                    commands.append(verb + " sgid=" + str(sgid) + " " + "|".join("cldbid=" + str(x) for x in cldbids[i:i + batch_size]))
+        return commands
+
+    def report(self):
+        """ A line describing each change, IE. for a dry run. """
+
+        lines = []
+        for (action, changes) in (("Removing", self.removes), ("Adding", self.adds)):
+            for (sgid, clients) in sorted(changes.items()):
+                for (cldbid, client) in sorted(clients.items()):
+                    lines.append(action + " \"" + client["client_nickname"] + "\" (" + str(cldbid) + ") " + ("from" if action == "Removing" else "to") + " group \"" + self.groups[sgid]["name"] + "\"")
+        return lines
+
+class GroupReconciler(object):
+
+    PROMOTION_CONNECTIONS = 50 #Connections a client in the default group needs to earn a promotion.
+
+    #The client fields the rules look at. All but "client_totalconnections" come with a flagged "clientlist", see TS3_API.getConnectedClients.
+    FIELDS = ["client_nickname", "client_database_id", "client_servergroups", "client_totalconnections"]
+
+    def __init__(self, server_groups, default_group):
+        """ server_groups is the response to "servergrouplist" and default_group the ID of the server's default group. Either typed or not. """
+
+        self.groups = dict((int(group["sgid"]), group) for group in server_groups)
+        self.default_group = int(default_group)
+
+        #Ranked once up front, best (lowest sortid) first. Compared as numbers, "10" is not above "9".
+        ranking = sorted(self.groups, key=lambda sgid: (int(self.groups[sgid]["sortid"]), sgid))
+        self.rank = dict((sgid, position) for (position, sgid) in enumerate(ranking))
+
+        #Templates and query groups (type 0 and 2) are no place for a client, only regular groups (type 1) are promoted to.
+        candidates = [sgid for sgid in ranking if sgid != self.default_group and int(self.groups[sgid].get("type", 1)) == 1]
+        self.promotion_group = candidates[-1] if candidates else None
+
+    def best(self, client):
+        """ The highest ranked group client is in, or None. """
+
+        groups = [sgid for sgid in serverGroupsOf(client) if sgid in self.rank]
+        return min(groups, key=self.rank.get) if groups else None
+
+    def target(self, client):
+        """ The groups client should be in. """
+
+        best = self.best(client)
+        if best is None:
+            return set()
+
+        connections = client.get("client_totalconnections") #Unknown for those who left before it could be fetched.
+        if best == self.default_group and connections is not None and int(connections) > self.PROMOTION_CONNECTIONS and self.promotion_group is not None:
+            return {self.promotion_group} #They've earned it. Leaving the default group is implicit once they're in another.
+
+        return {best}
+
+    def plan(self, clients, fetch=None):
+        """
+            Work out the changes needed to bring every client into their target groups. Clients connected more than once are only considered once.
+            Clients may lack "client_totalconnections" (IE. as a flagged "clientlist" gives them) if fetch is given. It's called as fetch(clients, fields)
+            to fill in the fields of just those up for promotion (IE. TS3_API.fillClientInfo). Any it couldn't, who have left since, aren't promoted this time.
+        """
+
+        plan = GroupPlan(self.groups)
+
+        if fetch is not None and self.promotion_group is not None:
+            needed = [client for client in clients if "client_totalconnections" not in client and self.best(client) == self.default_group]
+            if needed:
+                fetch(needed, ["client_totalconnections"])
+
+        for client in dict((int(client["client_database_id"]), client) for client in clients).values():
+
+            cldbid = int(client["client_database_id"])
+            current = serverGroupsOf(client)
+            target = self.target(client)
+
+            for sgid in target - current:
+                plan.add(sgid, cldbid, client)
+
+            for sgid in current - target:
+                if sgid in self.groups and sgid != self.default_group: #Membership of the default group can't be removed, it only lapses.
+                    plan.remove(sgid, cldbid, client)
+
+        return plan
+
+    def apply(self, api, plan, batch_size=100):
+        """ Send plan's commands, pipelined through api (a TS3_API or TS3_Pool). Returns (command, TS3Exception) for each command that failed. """
+
+        commands = plan.commands(batch_size)
+        return [(command, result) for (command, result) in zip(commands, api.submitCommands(commands)) if isinstance(result, TS3Exception)]
@@ -0,0 +1,255 @@
+'''
+    Declarative rules deciding which clients kickIdlers kicks, evaluated over every connected client at once.
+
+    A rule is a dictionary of conditions (see KickRule), all of which a client must meet for the rule to match them.
+    Thresholds may scale with the number of empty slots on the server, given as (base, per empty slot).
+    A client matching any rule is kicked, unless they match an exemption (written the same way, without a reason).
+
+    The clients' fields are gathered into one column per field and every condition is evaluated down a whole column,
+    with NumPy arrays where NumPy is installed and plain lists otherwise.
+
+'''
+try:
+    import numpy
+except ImportError: #Everything works without it, just slower on big servers.
+    numpy = None
+
+from Exceptions  import TS3Exception
+from TS3_Records import serverGroupsOf
+
+def convertMillis(millis):
+    """
+        Helper function to convert time from milliseconds to a more human readible format, namely a string in the form:
+            H hour(s) M minute(s) S second(s)
+    """
+
+    (minutes, seconds) = divmod(int(millis) // 1000, 60)
+    (hours, minutes) = divmod(minutes, 60)
+
+    parts = [str(value) + " " + unit + ("s" if value != 1 else "") for (value, unit) in ((hours, "hour"), (minutes, "minute"), (seconds, "second")) if value]
+    return " ".join(parts) if parts else "0 seconds"
+
+def isSet(value):
+    return value is True or value == "1" #Typed records hold booleans, dictionaries the server's "1" or "0".
+
+class KickRule(object):
+
+    def __init__(self, name, reason=None, min_idle_time=None, min_idle_percent=None, channels=None, server_groups=None, platforms=None,
+                 away=None, input_muted=None, output_muted=None):
+        """
+            name identifies the rule in the log, and reason is the message kicked clients see (no more than 40 characters, TS3's limit).
+            The conditions, each ignored if None:
+                min_idle_time       Milliseconds idle, at least.
+                min_idle_percent    Percentage of their time connected spent idle, at least.
+                channels            IDs of the channels the client must be in one of.
+                server_groups       IDs of the server groups the client must be in one of.
+                platforms           The platforms ("Windows", "ServerQuery"...) the client must be on one of.
+                away, input_muted, output_muted
+                                    Whether the client must be away, have their microphone muted, or their speakers muted.
+            min_idle_time and min_idle_percent may be (base, per empty slot) to be more lenient the emptier the server is.
+        """
+
+        if reason is not None and len(reason) > 40:
+            raise ValueError("The reason for a kick can be no greater than 40 characters. Rule \"" + name + "\"'s was:\"" + reason + "\".")
+
+        self.name = name
+        self.reason = reason if reason is not None else name
+        self.min_idle_time = min_idle_time
+        self.min_idle_percent = min_idle_percent
+        self.channels = set(int(x) for x in channels) if channels is not None else None
+        self.server_groups = set(int(x) for x in server_groups) if server_groups is not None else None
+        self.platforms = set(platforms) if platforms is not None else None
+        self.flags = dict((field, wanted) for (field, wanted) in (("away", away), ("input_muted", input_muted), ("output_muted", output_muted)) if wanted is not None)
+
+    def threshold(self, value, empty_slots):
+        if isinstance(value, (tuple, list)):
+            (base, per_slot) = value
+            return base + per_slot * empty_slots
+        return value
+
+class Columns(object):
+    """ The fields rules look at, as one column (a NumPy array, or a list without NumPy) per field across every client. """
+
+    def __init__(self, clients, use_numpy):
+
+        self.clients = clients
+        self.numpy = use_numpy
+
+        self.idle_time = self.column([int(client.get("client_idle_time") or 0) for client in clients])
+        connected_time = self.column([max(int(client.get("connection_connected_time") or 0), 1) for client in clients])
+        if use_numpy:
+            self.idle_percent = self.idle_time * 100.0 / connected_time
+        else:
+            self.idle_percent = [idle * 100.0 / connected for (idle, connected) in zip(self.idle_time, connected_time)]
+
+        self.channel = self.column([int(client.get("cid") or -1) for client in clients])
+        self.platform = [client.get("client_platform") for client in clients]
+        self.away = self.column([isSet(client.get("client_away")) for client in clients])
+        self.input_muted = self.column([isSet(client.get("client_input_muted")) for client in clients])
+        self.output_muted = self.column([isSet(client.get("client_output_muted")) for client in clients])
+        self.server_groups = [serverGroupsOf(client) for client in clients]
+
+    def column(self, values):
+        return numpy.array(values) if self.numpy else values
+
+    ######################## Whole column operations ########################
+
+    def everyone(self):
+        return numpy.ones(len(self.clients), dtype=bool) if self.numpy else [True] * len(self.clients)
+
+    def nobody(self):
+        return numpy.zeros(len(self.clients), dtype=bool) if self.numpy else [False] * len(self.clients)
+
+    def atLeast(self, column, threshold):
+        return column >= threshold if self.numpy else [x >= threshold for x in column]
+
+    def equals(self, column, value):
+        return column == value if self.numpy else [x == value for x in column]
+
+    def isIn(self, column, values):
+        if self.numpy:
+            return numpy.isin(column, list(values))
+        return [x in values for x in column]
+
+    def intersects(self, column, values):
+        """ For columns of sets, whether each has anything in common with values. There's no vectorizing sets, so it's always a list underneath. """
+        mask = [not x.isdisjoint(values) for x in column]
+        return numpy.array(mask, dtype=bool) if self.numpy else mask
+
+    def both(self, a, b):
+        return a & b if self.numpy else [x and y for (x, y) in zip(a, b)]
+
+    def either(self, a, b):
+        return a | b if self.numpy else [x or y for (x, y) in zip(a, b)]
+
+    def neither(self, a, b):
+        return a & ~b if self.numpy else [x and not y for (x, y) in zip(a, b)]
+
+class KickPolicy(object):
+
+    #The client fields rules look at. All but "connection_connected_time" come with a flagged "clientlist", see TS3_API.getConnectedClients.
+    FIELDS = ["cid", "client_nickname", "client_database_id", "client_idle_time", "connection_connected_time", "client_platform",
+              "client_away", "client_input_muted", "client_output_muted", "client_servergroups"]
+
+    def __init__(self, rules, exemptions=(), use_numpy=None):
+        """ rules and exemptions are lists of dictionaries of KickRule's arguments, IE. as in config.py. use_numpy defaults to whether NumPy is installed. """
+
+        self.rules = [KickRule(**rule) for rule in rules]
+        self.exemptions = [KickRule(**dict({"name": "exemption"}, **exemption)) for exemption in exemptions]
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+
+    def matches(self, rule, columns, empty_slots, idle_percent=True):
+        """ A mask of the clients meeting all of rule's conditions, or all but min_idle_percent if idle_percent is False. """
+
+        mask = columns.everyone()
+
+        if rule.min_idle_time is not None:
+            mask = columns.both(mask, columns.atLeast(columns.idle_time, rule.threshold(rule.min_idle_time, empty_slots)))
+        if rule.min_idle_percent is not None and idle_percent:
+            mask = columns.both(mask, columns.atLeast(columns.idle_percent, rule.threshold(rule.min_idle_percent, empty_slots)))
+        if rule.channels is not None:
+            mask = columns.both(mask, columns.isIn(columns.channel, rule.channels))
+        if rule.platforms is not None:
+            mask = columns.both(mask, columns.isIn(columns.platform, rule.platforms))
+        if rule.server_groups is not None:
+            mask = columns.both(mask, columns.intersects(columns.server_groups, rule.server_groups))
+        for (field, wanted) in rule.flags.items():
+            mask = columns.both(mask, columns.equals(getattr(columns, field), wanted))
+
+        return mask
+
+    def needsConnectedTime(self, columns, empty_slots):
+        """
+            A mask of the clients whose connected time could change who is kicked, or why; those meeting every other condition of a rule
+            or exemption with a min_idle_percent, and not already settled by an exemption or an earlier rule that doesn't have one.
+        """
+
+        exempt = columns.nobody() #Exempt whatever their connected time.
+        for exemption in self.exemptions:
+            if exemption.min_idle_percent is None:
+                exempt = columns.either(exempt, self.matches(exemption, columns, empty_slots))
+
+        needed = columns.nobody()
+        for exemption in self.exemptions:
+            if exemption.min_idle_percent is not None:
+                needed = columns.either(needed, columns.neither(self.matches(exemption, columns, empty_slots, idle_percent=False), exempt))
+
+        settled = exempt
+        for rule in self.rules:
+            if rule.min_idle_percent is None:
+                settled = columns.either(settled, self.matches(rule, columns, empty_slots))
+            else:
+                needed = columns.either(needed, columns.neither(self.matches(rule, columns, empty_slots, idle_percent=False), settled))
+
+        return needed
+
+    def indices(self, mask):
+        return numpy.flatnonzero(mask).tolist() if self.use_numpy else [i for (i, x) in enumerate(mask) if x]
+
+    def evaluate(self, server_info, clients, limit=None, fetch=None):
+        """
+            Returns the (client, rule) pairs to kick, each client with the first rule they matched, ranked most idle first.
+            With a limit only that many of the most idle are returned.
+            Clients may lack "connection_connected_time" (IE. as a flagged "clientlist" gives them) if fetch is given. It's called as fetch(clients, fields)
+            to fill in the fields of just the clients whose connected time matters, and returns those who have left since (IE. TS3_API.fillClientInfo).
+        """
+
+        if not clients:
+            return []
+
+        empty_slots = int(server_info["virtualserver_maxclients"]) - int(server_info["virtualserver_clientsonline"])
+        columns = Columns(clients, self.use_numpy)
+
+        if fetch is not None:
+            needed = [clients[i] for i in self.indices(self.needsConnectedTime(columns, empty_slots)) if "connection_connected_time" not in clients[i]]
+            if needed:
+                gone = set(id(client) for client in fetch(needed, ["connection_connected_time"]))
+                clients = [client for client in clients if id(client) not in gone]
+                columns = Columns(clients, self.use_numpy)
+
+        exempt = columns.nobody()
+        for exemption in self.exemptions:
+            exempt = columns.either(exempt, self.matches(exemption, columns, empty_slots))
+
+        matched = {} #Client index -> the first rule they matched.
+        for rule in self.rules:
+            mask = columns.neither(self.matches(rule, columns, empty_slots), exempt)
+            for i in self.indices(mask):
+                matched.setdefault(i, rule)
+
+        ranked = sorted(matched, key=lambda i: -columns.idle_time[i])[:limit]
+        return [(clients[i], matched[i]) for i in ranked]
+
+    def describe(self, client, rule):
+        """ Why client is being kicked, for the log. """
+
+        idle_time = int(client.get("client_idle_time") or 0)
+        if "connection_connected_time" not in client: #Never fetched, it didn't matter.
+            return rule.name + "; idle for " + convertMillis(idle_time) + "."
+
+        idle_percent = int(idle_time * 100 / max(int(client["connection_connected_time"] or 0), 1))
+        return rule.name + "; idle for " + convertMillis(idle_time) + ", " + str(idle_percent) + "% of time connected."
+
+    def apply(self, api, kicks):
+        """
+            Kick the (client, rule) pairs evaluate returned through api (a TS3_API), with one "clientkick" naming every client per rule.
+            Should a batch fail its clients are retried one by one, so someone leaving in the meantime doesn't save everybody else.
+            Returns (client, TS3Exception) for each client that could not be kicked.
+        """
+
+        batches = {} #Rule -> clients it's kicking, in rank order.
+        for (client, rule) in kicks:
+            batches.setdefault(rule, []).append(client)
+
+        failures = []
+        for (rule, clients) in batches.items():
+            try:
+                api.kickClients([client["clid"] for client in clients], rule.reason, True)
+            except TS3Exception:
+                for client in clients:
+                    try:
+                        api.kickClients([client["clid"]], rule.reason, True)
+                    except TS3Exception as e:
+                        failures.append((client, e))
+
+        return failures
@@ -4,35 +4,139 @@
 
     A small logger class to commit application output to file.
 
+    Lines are handed to a background thread through a queue, so logging never waits on the disk or console. The thread keeps
+    the day's file open, flushing it every flush_size lines or flush_interval seconds, and moves on to a new file when the date changes.
+    Everything still queued is written out by flush(), by close(), and when the interpreter exits.
+
 '''
+import atexit
+import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
 class Logger(object):
 
     LOG_DIR = ""
 
-    def log(self, line):
+    def log(self, line, **fields):
+        """ Log a line. Any keyword arguments are recorded alongside it as fields of the line's JSON object if json_lines is set, and ignored otherwise. """
+
+        with self.lock: #Only ever held for a moment, never whilst writing.
+            if not self.closed:
+                self.queue.put((datetime.now(), line, fields)) #Under the lock, so it can't land behind close()'s sentinel.
+                return
+
+        #Nobody left to hand it to, write it ourselves; after whatever the writer still has, so the lines stay in order.
+        self.writer.join()
+        with self.file_lock:
+            self.write(datetime.now(), line, fields)
+            self.file.close() #Not kept open, there's no close() to come for it.
+            self.file = None
+            self.file_date = None
+
+    def flush(self):
+        """ Block until every line logged so far is in the file. """
+
+        done = threading.Event()
+
+        with self.lock:
+            if self.closed:
+                return
+            self.queue.put(done)
+
+        done.wait()
+
+    def close(self):
+        """ Write out everything still queued, then stop the writer thread and close the file. """
+
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True #Anything logged from here on is written by log() itself...
+            self.queue.put(None)
+
+        self.writer.join() #...once the writer has finished with what came before.
+
+    def drain(self):
+        """ Body of the writer thread. """
 
-        #Get out current date & time and format it to look nice.
-        date = datetime.today().strftime("%Y-%m-%d")
-        timestamp = "[" + datetime.now().time().strftime("%H:%M") + "] "
+        pending = 0 #Lines written since the last flush.
+        last_flush = time.monotonic()
 
-        #Open the relevant log file in append mode.
-        myFile = open(self.LOG_DIR + "/" + date + ".txt", 'a')
+        while True:
+
+            try:
+                item = self.queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty: #Gone quiet, get what we've got onto the disk.
+                item = False
+
+            #The file is ours alone until we return, nothing here holds up log().
+            if isinstance(item, tuple):
+                self.write(*item)
+                pending += 1
+                if pending < self.flush_size and time.monotonic() - last_flush < self.flush_interval:
+                    continue
+
+            if self.file is not None:
+                self.file.flush()
+            pending = 0
+            last_flush = time.monotonic()
+
+            if isinstance(item, threading.Event): #Someone's waiting on flush().
+                item.set()
+
+            elif item is None: #close(), the last thing queued.
+                if self.file is not None:
+                    self.file.close()
+                self.file = None
+                self.file_date = None
+                return
+
+    def write(self, when, line, fields):
+
+        #Open the relevant log file in append mode, once a day.
+        date = when.strftime("%Y-%m-%d")
+        if date != self.file_date:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(self.LOG_DIR + "/" + date + (".jsonl" if self.json_lines else ".txt"), 'a')
+            self.file_date = date
 
         #Put a timestamp on the string to be logged.
-        line = timestamp + line.replace('\n', '\n' + ' ' * len(timestamp))
+        timestamp = "[" + when.strftime("%H:%M") + "] "
+        text = timestamp + line.replace('\n', '\n' + ' ' * len(timestamp))
 
-        print(line)                  #Log it in console...
-        myFile.write(line + "\n")    #...and in our text files.
+        if self.echo:
+            print(text) #Log it in console...
 
-        #Close 'er up. We're done here.
-        myFile.close()
+        if self.json_lines: #...and in our files.
+            self.file.write(json.dumps(dict(fields, time=when.isoformat(timespec="seconds"), message=line)) + "\n")
+        else:
+            self.file.write(text + "\n")
 
-    def __init__(self, LOG_DIR):
+    def __init__(self, LOG_DIR, json_lines=False, flush_size=100, flush_interval=1.0, echo=True):
+        """ Log to a file a day in LOG_DIR; as text, or as one JSON object per line if json_lines is set. echo also prints each line to the console. """
 
         self.LOG_DIR = LOG_DIR
+        self.json_lines = json_lines
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.echo = echo
 
         if not (os.path.exists(LOG_DIR) and os.path.isdir(LOG_DIR)):
             os.mkdir(LOG_DIR)
+
+        self.file = None
+        self.file_date = None
+        self.lock = threading.Lock()      #Guards closed, so a line is either queued ahead of close()'s sentinel or written by log() itself.
+        self.file_lock = threading.Lock() #Guards the file between log()s writing it themselves once we're closed.
+        self.closed = False
+
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.drain, name="Logger", daemon=True)
+        self.writer.start()
+
+        atexit.register(self.close) #So no lines are lost when the program ends.
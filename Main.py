@@ -8,138 +8,200 @@ Created on 6 Jul 2016
 
 '''
 import os
+import signal
 import sys
-import time
 
 from config     import *
 from Logger     import Logger
 from TS3_API    import TS3_API
-from Exceptions import TS3Exception
+from TS3_Pool   import TS3_Pool
+from Daemon     import TS3_Daemon
+from GroupReconciler import GroupReconciler
+from KickPolicy import KickPolicy
+from Orchestrator import Orchestrator
+from ClientHistory import ClientHistory
 
 API = None
+POOL = None #Extra sessions to spread per-client commands across, if POOL_SIZE > 1.
 LOGGER = None
+HISTORY = None #ClientHistory recording each run, if HISTORY_FILE is set.
+DRY_RUN = False #Log the changes we'd make (kicks, group changes) without making them.
 
-def manageUsersGroups(server_info, connected_clients):
+#What our policies need to know of each client. One flagged "clientlist" brings most of it, the policies fetch the rest for just the clients they must.
+CLIENT_FIELDS = sorted(set(KickPolicy.FIELDS + GroupReconciler.FIELDS))
+
+def clientFetcher(api):
+    """ For the policies to fetch what a flagged "clientlist" lacks; TS3_API.fillClientInfo through api, spread across POOL if api is our own session. """
+
+    pool = POOL if api is API else None
+    return lambda clients, fields: api.fillClientInfo(clients, fields, pool)
+
+def recordHistory(server_info, connected_clients, api=None, logger=None):
+    """ Adds the server's occupancy and a snapshot of the connected clients to HISTORY, for policies and reports looking back over past runs. Returns the number of clients recorded. """
+
+    api = api or API
+    return HISTORY.record(api.session["address"] + ":" + str(api.session["port"]), api.session["sid"], server_info, connected_clients)
+
+def policies():
+    """ What's run on each server, in order. """
+    return ([recordHistory] if HISTORY is not None else []) + [kickIdlers, manageUsersGroups]
+
+def manageUsersGroups(server_info, connected_clients, api=None, logger=None):
     """
-        Iterates over every client currently connected to the server and:
+        Brings every client currently connected to the server into line:
             1. Checks that no client belongs to more than 1 server group. If they do remove them from all but there highest ranked group (Based on groupsortid)
             2. If a client is only a member of the default group and they have > 50 connections, upgrade their rank to 'User'.
+        The changes for every client are worked out at once and made with a command per group, see GroupReconciler.
+        Works on API (and POOL) and logs to LOGGER unless given an api and logger of its own, as by the Orchestrator. Returns the number of group changes made.
     """
 
-    server_groups = dict([(x["sgid"], x) for x in API.getServerGroups()]) #Get the list of server groups and their information (In the form of a dictionary using the group ID as a key for lookup purposes).
-
-    #Ugly means to find the next rank above the default one using "sortid".
-    LOWEST_NON_DEFAULT_GROUP_ID = max(server_groups, key=lambda x: int(server_groups[x]["sortid"]) if x is not server_info["virtualserver_default_server_group"] else -1)
+    (target, api, logger) = (POOL or API, API, LOGGER) if api is None else (api, api, logger or LOGGER)
 
-    for client in connected_clients:
+    reconciler = GroupReconciler(api.getServerGroups(), server_info["virtualserver_default_server_group"])
+    plan = reconciler.plan(connected_clients, clientFetcher(api))
 
-        client_groups = client["client_servergroups"].split(',') #IDs come as a single string delimited with ",". Example; "1,2,3,4".
+    for line in plan.report():
+        logger.log(line)
 
-        #Get the users best group based on the groups sort IDs.
-        best_SGID = min(client_groups, key=lambda x: server_groups[x]["sortid"])
+    if DRY_RUN or len(plan) == 0:
+        return len(plan)
 
-        #If their best group is the default group and they've connected 50 times promote them, they earned it.
-        if best_SGID is server_info["virtualserver_default_server_group"] and int(client["client_totalconnections"]) > 50:
-            LOGGER.log("Adding \"" + client["client_nickname"] + "\" (" + client["client_database_id"] + ") to group \"" + server_groups[LOWEST_NON_DEFAULT_GROUP_ID]["name"] + "\"")
-            API.addClientToServerGroup(client["client_database_id"], LOWEST_NON_DEFAULT_GROUP_ID)
-        else:
-            #For all other ranks remove.
-            for group in client_groups:
-                if group != best_SGID:
-                    LOGGER.log("Removing \"" + client["client_nickname"] + "\" (" + client["client_database_id"] + ") from group \"" + server_groups[group]["name"] + "\"")
-                    API.removeClientFromServerGroup(client["client_database_id"], group)
+    for (command, error) in reconciler.apply(target, plan):
+        logger.log("\"" + command + "\" failed (" + str(error) + ")")
 
-        time.sleep(1) #Take a rest to prevent recieve a flood ban from the server.
+    return len(plan)
 
-def kickIdlers(server_info, connected_clients):
+def kickIdlers(server_info, connected_clients, api=None, logger=None):
     """
         Kicks clients who have either been idle for too long or for too much of their time connected.
-        The definitions of "too long/much" is dynamic and depends upon the number of users connected to the server.
+        The definitions of "too long/much" are the KICK_RULES of config.py, and are dynamic as they depend upon the number of users connected to the server.
+        Works on API and logs to LOGGER unless given an api and logger of its own. Returns the number of clients kicked.
     """
 
-    idlers = [] #We're going to collect clients requiring a kick in a list, then kick them all at once for exception handling reasons.
+    api = api or API
+    logger = logger or LOGGER
 
-    BASE_MAX_IDLE_PERCENTAGE = 75
-    server_info["virtualserver_emptyslots"] = int(server_info["virtualserver_maxclients"]) - int(server_info["virtualserver_clientsonline"])
+    policy = KickPolicy(KICK_RULES, KICK_EXEMPTIONS)
+    idlers = policy.evaluate(server_info, connected_clients, KICK_LIMIT, clientFetcher(api)) #Every client is judged at once, the most idle first.
 
-    #10 minute base with 5 minutes for every available slot.
-    max_idle_time = 600_000 + (int(server_info["virtualserver_emptyslots"]) * 5 * 60 * 1000)
+    for (client, rule) in idlers:
+        logger.log("Kicking \"" + client["client_nickname"] + "\" (" + str(client["client_database_id"]) + ") for reason: " + policy.describe(client, rule))
 
-    for client in connected_clients:
+    if DRY_RUN:
+        return len(idlers)
 
-        #Ignore ServerQuery clients (That's us!).
-        if client["client_platform"] == "ServerQuery":
-            continue
+    failed = policy.apply(api, idlers) #A single "clientkick" per rule. Failed kicks are then logged for debugging purposes.
+    for (client, result) in failed:
+        logger.log(client["client_nickname"] + "\" (" + str(client["client_database_id"]) + ") could not be kicked (" + str(result) + ")")
 
-        #If a client has exceeded the maximum time allowed to be idle, kick them.
-        if int(client["client_idle_time"]) >= max_idle_time:
-            idlers.append((client, "Idle for " + convertMillis(int(client["client_idle_time"])) + "."))
-            continue
+    logger.log("Kicked " + str(len(idlers) - len(failed)) + " clients.")
+    return len(idlers) - len(failed)
 
-        #Calculate the percentage of time a client has been idle while connected to the server.
-        client_idle_percent = int(int(client["client_idle_time"])/float(client["connection_connected_time"]) * 100)
-        #If a client has spent more than (BASE_MAX_IDLE_PERCENTAGE + 1% for each empty slot) percent of their time idle, kick them.
-        if client_idle_percent > BASE_MAX_IDLE_PERCENTAGE + int(server_info["virtualserver_emptyslots"]):
-            idlers.append((client, "Idle for " + str(client_idle_percent) + "% of time connected."))
-            continue
+def manageAllServers():
+    """
+        Runs our policies on every virtual server of every instance in INSTANCES (or just of DOMAIN's instance if there are none), see Orchestrator.
+        Returns whether every server was managed without error.
+    """
 
-    for (client, reason) in idlers:
+    instances = INSTANCES or [{"address": DOMAIN, "port": PORT, "username": USERNAME, "password": PASSWORD, "sessions": POOL_SIZE,
+                               "whitelisted": FLOOD_WHITELISTED, "flood_commands": FLOOD_COMMANDS, "flood_time": FLOOD_TIME}]
 
-        LOGGER.log("Kicking \"" + client["client_nickname"] + "\" (" + client["client_database_id"] + ") for reason: " + reason)
+    orchestrator = Orchestrator(instances, policies(), LOGGER, typed=True, keepalive_interval=KEEPALIVE_INTERVAL, fields=CLIENT_FIELDS)
+    results = orchestrator.run()
 
-        try: #Attempt the kick.
-            API.kick(client["clid"], reason, True)
-            time.sleep(1) #Take a break to prevent a flood ban.
-        except TS3Exception as e: #Failed kicks are then logged for debugging purposes.
-            LOGGER.log(client["client_nickname"] + "\" (" + client["client_database_id"] + ") could not be kicked (" + str(e) + ")")
+    for result in results: #A sit. rep. for each server.
+        LOGGER.log(str(result))
+    LOGGER.log("Managed " + str(len(results)) + " virtual servers, " + str(len([x for x in results if x.error is not None])) + " failed.")
 
-    LOGGER.log("Kicked " + str(len(idlers)) + " clients.")
+    if METRICS_FILE is not None:
+        dumpMetrics(METRICS_FILE, orchestrator.metrics)
 
-def convertMillis(millis):
-    """
-        Helper function to convert time from milliseconds to a more human readible format, namely a string in the form:
-            H hour(s) M minute(s) S second(s)
-    """
+    return all(result.error is None for result in results)
 
-    millis /= 1000
-    seconds = millis % 60
+def dumpMetrics(path, metrics=None):
+    """ Write metrics (by default those of our session and the pool's) to path, as JSON if it ends in ".json" and in Prometheus' text format otherwise. """
 
-    millis /= 60
-    minutes = millis % 60
+    if metrics is None:
+        metrics = API.metrics
+        if POOL is not None:
+            metrics = POOL.metrics()
+            metrics.merge(API.metrics)
 
-    hours = (millis/60)
+    with open(path, "w") as f:
+        f.write(metrics.toJSON() if path.endswith(".json") else metrics.toPrometheus())
 
-    return((hours + " hour" + ("s" if hours > 1 else "")) if hours != 0 else "" +
-           (minutes + " minute" + ("s" if minutes > 1 else "")) if minutes != 0 else "" +
-           (seconds + " seconds" + ("s" if seconds > 1 else "")) if seconds != 0 else "")
+    LOGGER.log("Sent " + str(sum(metrics.commands.values())) + " commands, waited " + ("%.1f" % metrics.flood_wait_time) + "s on flood control. Metrics written to " + path + ".")
 
 if __name__ == '__main__':
 
     os.chdir(sys.argv[0] + "/..") #Change our working directory to where this executed file is located.
 
+    DRY_RUN = "--dry-run" in sys.argv[1:]
+
+    if HISTORY_FILE is not None:
+        HISTORY = ClientHistory(HISTORY_FILE)
+        HISTORY.prune(HISTORY_DAYS)
+
+    if "--all-servers" in sys.argv[1:]: #Every virtual server we look after in one go, rather than a process per server.
+        LOGGER = Logger("logs", json_lines=LOG_JSON)
+        LOGGER.log("RUNNING TS3Bot over every server!")
+        succeeded = manageAllServers()
+        LOGGER.close()
+        if HISTORY is not None:
+            HISTORY.close()
+        sys.exit(0 if succeeded else 1)
+
     API = TS3_API()     #Setup the telnet connection to the TS3 server.
-    API.sleep_time = 1  #Set the sleep time between server requests. This prevents flooding the server and it taking anti-flood measures.
+    API.typed = True    #Our policies work with numbers and lists rather than strings, see TS3_Records.
+    API.keepalive_interval = KEEPALIVE_INTERVAL
 
     #Set up the logger.
-    LOGGER = Logger("logs")
+    LOGGER = Logger("logs", json_lines=LOG_JSON)
     LOGGER.log("RUNNING TS3Bot!")
 
     #Connect to the TS3 server and login.
+    API.configureFloodControl(FLOOD_WHITELISTED, FLOOD_COMMANDS, FLOOD_TIME) #Pace our requests so the server doesn't take anti-flood measures, logging in included.
     API.connect(DOMAIN, PORT)
     API.login(USERNAME, PASSWORD)
 
-    #Acquire server info and connected clients.
-    server_info = API.getServerInfo()
-    connected_clients =  API.getConnectedClients(detailed=True)
+    if POOL_SIZE > 1: #Each session gets its own flood allowance, so per-client work goes K times faster spread across K of them.
+        POOL = TS3_Pool(DOMAIN, PORT, USERNAME, PASSWORD, POOL_SIZE, nickname=USERNAME + " (pool)", whitelisted=FLOOD_WHITELISTED, flood_commands=FLOOD_COMMANDS, flood_time=FLOOD_TIME, typed=True, keepalive_interval=KEEPALIVE_INTERVAL)
+        POOL.open()
 
-    #Execute the heart of our script!
-    kickIdlers(server_info, connected_clients)
-    manageUsersGroups(server_info, connected_clients)
+    if "--daemon" in sys.argv[1:]: #Stay connected, tracking clients through the server's notifications and running our policies on a schedule.
+        daemon = TS3_Daemon(API, policies(), DAEMON_INTERVAL, LOGGER)
+
+        def stopDaemon(signum, frame):
+            """ Ctrl+C or a SIGTERM: let the daemon finish what it's reading so the connection can still be used to close up shop. """
+            signal.signal(signal.SIGINT, signal.default_int_handler) #A second Ctrl+C stops us there and then.
+            daemon.stop()
+
+        signal.signal(signal.SIGINT, stopDaemon)
+        signal.signal(signal.SIGTERM, stopDaemon)
+        daemon.run()
+        LOGGER.log("Stopping TS3Bot.")
+
+    else:
+        #Acquire server info and connected clients.
+        server_info = API.getServerInfo()
+        connected_clients = API.getConnectedClients(fields=CLIENT_FIELDS)
+
+        #Execute the heart of our script!
+        for policy in policies():
+            policy(server_info, connected_clients)
 
     #Give us a closing sit. rep.
     server_info = API.getServerInfo()
-    LOGGER.log("Server @ " + server_info["virtualserver_clientsonline"] + "/" + server_info["virtualserver_maxclients"] + ".")
+    LOGGER.log("Server @ " + str(server_info["virtualserver_clientsonline"]) + "/" + str(server_info["virtualserver_maxclients"]) + ".")
+
+    if METRICS_FILE is not None:
+        dumpMetrics(METRICS_FILE)
 
     #Formally close up shop.
+    if POOL is not None:
+        POOL.close()
     API.logout()
     API.disconnect()
+    LOGGER.close()
+    if HISTORY is not None:
+        HISTORY.close()
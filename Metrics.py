@@ -0,0 +1,154 @@
+'''
+    Counters and latency histograms for the commands a TS3_API sends, to see where a run's time goes.
+
+    Everything is broken down by command verb ("clientinfo", "servergroupaddclient"...). Snapshots can be exported
+    as JSON or in the Prometheus text exposition format.
+
+'''
+import bisect
+import json
+from collections import Counter
+
+#Upper bounds (seconds) of the histogram buckets. Round trips on a LAN take around a millisecond; a flood limited one can take seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PARSE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+class Histogram(object):
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1) #The last bucket is everything beyond the last bound.
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for (i, n) in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip([str(x) for x in self.bounds] + ["+Inf"], self.buckets))}
+
+class Metrics(object):
+
+    def __init__(self):
+        self.commands = Counter()       #Verb -> commands sent.
+        self.errors = Counter()         #(verb, TS3Exception error ID) -> responses that were errors.
+        self.bytes_sent = Counter()     #Verb -> bytes sent.
+        self.bytes_received = Counter() #Verb -> bytes received in response.
+        self.latency = {}               #Verb -> Histogram of seconds from sending a command to its response being read.
+        self.parse_time = {}            #Verb -> Histogram of seconds spent parsing responses.
+        self.flood_waits = 0            #Commands that had to wait on flood control...
+        self.flood_wait_time = 0.0      #...and the seconds spent waiting.
+
+    def sent(self, verb, size):
+        self.commands[verb] += 1
+        self.bytes_sent[verb] += size
+
+    def received(self, verb, size):
+        self.bytes_received[verb] += size
+
+    def error(self, verb, error_ID):
+        self.errors[(verb, str(error_ID))] += 1
+
+    def roundTrip(self, verb, seconds):
+        self.histogram(self.latency, verb, LATENCY_BUCKETS).observe(seconds)
+
+    def parsed(self, verb, seconds):
+        self.histogram(self.parse_time, verb, PARSE_BUCKETS).observe(seconds)
+
+    def floodWait(self, seconds):
+        if seconds > 0:
+            self.flood_waits += 1
+            self.flood_wait_time += seconds
+
+    def histogram(self, histograms, verb, bounds):
+        if verb not in histograms:
+            histograms[verb] = Histogram(bounds)
+        return histograms[verb]
+
+    def merge(self, other):
+        """ Add another Metrics' counts to these, IE. to total up the sessions of a TS3_Pool. """
+
+        for name in ("commands", "errors", "bytes_sent", "bytes_received"):
+            getattr(self, name).update(getattr(other, name))
+
+        for name in ("latency", "parse_time"):
+            for (verb, histogram) in getattr(other, name).items():
+                self.histogram(getattr(self, name), verb, histogram.bounds).merge(histogram)
+
+        self.flood_waits += other.flood_waits
+        self.flood_wait_time += other.flood_wait_time
+
+    ###############################################################################
+    ################################## Exports ####################################
+    ###############################################################################
+
+    def snapshot(self):
+        """ Everything as plain dictionaries, ready for json.dumps. """
+
+        return {
+            "commands": dict(self.commands),
+            "errors": dict((verb + " " + error_ID, n) for ((verb, error_ID), n) in self.errors.items()),
+            "bytes_sent": dict(self.bytes_sent),
+            "bytes_received": dict(self.bytes_received),
+            "latency_seconds": dict((verb, x.snapshot()) for (verb, x) in self.latency.items()),
+            "parse_seconds": dict((verb, x.snapshot()) for (verb, x) in self.parse_time.items()),
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_time
+        }
+
+    def toJSON(self):
+        return json.dumps(self.snapshot(), indent=4, sort_keys=True)
+
+    def toPrometheus(self, prefix="ts3bot"):
+        """ The metrics in Prometheus' text exposition format. """
+
+        lines = []
+
+        def family(name, kind, text):
+            lines.append("# HELP " + prefix + "_" + name + " " + text)
+            lines.append("# TYPE " + prefix + "_" + name + " " + kind)
+
+        def sample(name, labels, value):
+            label_text = ",".join(key + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"") + "\"" for (key, value) in labels)
+            lines.append(prefix + "_" + name + ("{" + label_text + "}" if label_text else "") + " " + repr(value))
+
+        for (name, counter, text) in (
+            ("commands_total", self.commands, "ServerQuery commands sent."),
+            ("bytes_sent_total", self.bytes_sent, "Bytes of commands sent."),
+            ("bytes_received_total", self.bytes_received, "Bytes of responses received.")
+        ):
+            family(name, "counter", text)
+            for (verb, n) in sorted(counter.items()):
+                sample(name, [("command", verb)], n)
+
+        family("errors_total", "counter", "Commands answered with an error, by error ID.")
+        for ((verb, error_ID), n) in sorted(self.errors.items()):
+            sample("errors_total", [("command", verb), ("id", error_ID)], n)
+
+        for (name, histograms, text) in (
+            ("latency_seconds", self.latency, "Seconds from sending a command to reading its response."),
+            ("parse_seconds", self.parse_time, "Seconds spent parsing responses.")
+        ):
+            family(name, "histogram", text)
+            for (verb, histogram) in sorted(histograms.items()):
+                cumulative = 0
+                for (bound, n) in zip([str(x) for x in histogram.bounds] + ["+Inf"], histogram.buckets):
+                    cumulative += n
+                    sample(name + "_bucket", [("command", verb), ("le", bound)], cumulative)
+                sample(name + "_sum", [("command", verb)], histogram.sum)
+                sample(name + "_count", [("command", verb)], histogram.count)
+
+        family("flood_waits_total", "counter", "Commands held back by flood control.")
+        sample("flood_waits_total", [], self.flood_waits)
+        family("flood_wait_seconds_total", "counter", "Seconds spent waiting on flood control.")
+        sample("flood_wait_seconds_total", [], self.flood_wait_time)
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,183 @@
+'''
+    Runs Main's policies over every virtual server of several TS3 instances from one process.
+
+    Each instance's online virtual servers are found with "serverlist" and shared out between its sessions (a TS3_Pool of up to
+    the instance's "sessions" setting). A session works through its share one server after another, switching between them with "use".
+    The instances, and the sessions of each, all run at once. How every server fared comes back as a ServerResult.
+
+'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Exceptions import TS3Exception
+from Metrics    import Metrics
+from TS3_API    import CONNECTION_ERRORS
+from TS3_Pool   import TS3_Pool
+
+SESSION_ERRORS = (TS3Exception,) + CONNECTION_ERRORS #What a server or session going wrong looks like.
+
+INSTANCE_DEFAULTS = {
+    "port": 10011,
+    "username": "serveradmin",
+    "password": "",
+    "nickname": None,       #The username if None.
+    "servers": None,        #Virtual server IDs to manage, None for every one that's online.
+    "sessions": 1,          #Sessions working through the servers at once, each with its own login and flood allowance.
+    "whitelisted": False,   #See TS3_API.configureFloodControl.
+    "flood_commands": None,
+    "flood_time": None
+}
+
+class ServerResult(object):
+    """ How running the policies on a virtual server went. """
+
+    def __init__(self, instance, sid, name=None):
+        self.instance = instance #The instance's "address:port".
+        self.sid = sid
+        self.name = name
+        self.clients_online = None
+        self.max_clients = None
+        self.outcomes = {}   #Policy name -> what it returned (IE. the number of clients kicked).
+        self.error = None    #The exception that stopped us, if one did.
+        self.seconds = 0.0
+
+    def __str__(self):
+        text = self.instance + " sid " + str(self.sid) + (" \"" + self.name + "\"" if self.name else "")
+        if self.clients_online is not None:
+            text += " @ " + str(self.clients_online) + "/" + str(self.max_clients)
+        if self.outcomes:
+            text += ": " + ", ".join(name + " " + str(outcome) for (name, outcome) in self.outcomes.items())
+        if self.error is not None:
+            text += " FAILED (" + str(self.error) + ")"
+        return text + " in " + ("%.1f" % self.seconds) + "s."
+
+class ServerLogger(object):
+    """ Hands a policy's lines to the real Logger, labelled with the server they're about. """
+
+    def __init__(self, logger, instance, sid):
+        self.logger = logger
+        self.instance = instance
+        self.sid = sid
+
+    def log(self, line, **fields):
+        self.logger.log("[" + self.instance + " sid " + str(self.sid) + "] " + line, instance=self.instance, sid=self.sid, **fields)
+
+class Orchestrator(object):
+
+    def __init__(self, instances, policies, logger, typed=True, keepalive_interval=None, fields=None):
+        """
+            instances is a list of dictionaries, each with an "address" and any of INSTANCE_DEFAULTS' settings.
+            policies is a list of functions taking (server_info, connected_clients, api, logger) like Main's, run in order on every server.
+            fields are the client fields the policies need (see TS3_API.getConnectedClients), or None for every client's full "clientinfo".
+        """
+
+        self.instances = [dict(INSTANCE_DEFAULTS, **instance) for instance in instances]
+        self.policies = policies
+        self.logger = logger
+        self.typed = typed
+        self.keepalive_interval = keepalive_interval
+        self.fields = fields
+        self.metrics = Metrics() #Totalled from every session as it's closed...
+        self.metrics_lock = threading.Lock() #...which happens on several threads at once.
+
+    def run(self):
+        """ Run the policies on every server of every instance. Returns a ServerResult per server, by instance and then server ID. """
+
+        with ThreadPoolExecutor(max_workers=max(len(self.instances), 1)) as executor:
+            return [result for results in executor.map(self.runInstance, self.instances) for result in results]
+
+    def label(self, instance):
+        return instance["address"] + ":" + str(instance["port"])
+
+    def pool(self, instance):
+        """ An instance's sessions, opened as they're needed. They start without a virtual server selected, server 1 may not even exist. """
+
+        return TS3_Pool(instance["address"], instance["port"], instance["username"], instance["password"], max(instance["sessions"], 1), sid=None, nickname=instance["nickname"],
+                        whitelisted=instance["whitelisted"], flood_commands=instance["flood_commands"], flood_time=instance["flood_time"],
+                        typed=self.typed, keepalive_interval=self.keepalive_interval)
+
+    def closePool(self, pool):
+
+        with self.metrics_lock:
+            self.metrics.merge(pool.metrics())
+        pool.close()
+
+    def discover(self, api, instance):
+        """ The online virtual servers of an instance we're to manage, as "serverlist" rows. """
+
+        servers = api.getServerList()
+        servers = servers if isinstance(servers, list) else [servers] #Lists of one come back as just the map.
+
+        return [server for server in servers if server["virtualserver_status"] == "online" and
+                (instance["servers"] is None or int(server["virtualserver_id"]) in instance["servers"])]
+
+    def runInstance(self, instance):
+
+        label = self.label(instance)
+        pool = self.pool(instance)
+
+        try:
+            first = pool.add()
+        except SESSION_ERRORS as e:
+            self.logger.log("Could not log in to " + label + " (" + str(e) + ")")
+            result = ServerResult(label, None)
+            result.error = e
+            return [result]
+
+        try:
+            servers = self.discover(first, instance)
+        except SESSION_ERRORS as e:
+            self.logger.log("Could not list the virtual servers of " + label + " (" + str(e) + ")")
+            self.closePool(pool)
+            result = ServerResult(label, None)
+            result.error = e
+            return [result]
+
+        self.logger.log("Managing " + str(len(servers)) + " virtual servers of " + label + ".")
+
+        for index in range(1, min(instance["sessions"], len(servers))):
+            try:
+                pool.add()
+            except SESSION_ERRORS as e:
+                self.logger.log("Could not open session " + str(index + 1) + " to " + label + ", the others will carry on without it (" + str(e) + ")")
+                break
+
+        try: #Each session works through the servers one after another, taking the next as it finishes one.
+            results = pool.map(lambda api, server: self.runServer(api, label, server), servers)
+        except SESSION_ERRORS as e: #IE. a session that went quiet couldn't be replaced.
+            self.logger.log("Lost the sessions to " + label + " (" + str(e) + ")")
+            result = ServerResult(label, None)
+            result.error = e
+            results = [result]
+        finally:
+            self.closePool(pool)
+
+        return sorted(results, key=lambda result: result.sid or 0)
+
+    def runServer(self, api, label, server):
+        """ Select a virtual server and run every policy on it. """
+
+        started = time.monotonic()
+        result = ServerResult(label, int(server["virtualserver_id"]), server.get("virtualserver_name"))
+        logger = ServerLogger(self.logger, label, result.sid)
+
+        try:
+            if api.session["sid"] != result.sid:
+                api.changeSID(result.sid)
+
+            server_info = api.getServerInfo()
+            connected_clients = api.getConnectedClients(detailed=self.fields is None, fields=self.fields)
+
+            for policy in self.policies:
+                result.outcomes[policy.__name__] = policy(server_info, connected_clients, api, logger)
+
+            server_info = api.getServerInfo() #After the policies have had their way.
+            (result.clients_online, result.max_clients) = (server_info["virtualserver_clientsonline"], server_info["virtualserver_maxclients"])
+
+        except SESSION_ERRORS as e: #One server going wrong shouldn't hold up the rest.
+            result.error = e
+            logger.log("Failed (" + str(e) + ")")
+
+        result.seconds = time.monotonic() - started
+        return result
@@ -4,59 +4,153 @@ Created on 4 Jul 2016
 @author: Tom
 '''
 
-import telnetlib, time
-from Exceptions import IllegalStateException, TS3Exception
-
-TS3_ESCAPE = [ #Series of escape characters required to communicate successfully with TS3.
-        ("\\", r"\\"), # \
-        ("/", r"\/"),  # /
-        (" ", r"\s"),  # Space
-        ("|", r"\p"),  # |
-        ("\a", r"\a"), # Bell
-        ("\b", r"\b"), # Backspace
-        ("\f", r"\f"), # Form Feed
-        ("\n", r"\n"), # Newline
-        ("\r", r"\r"), # Carriage Return
-        ("\t", r"\t"), # Horizontal Tab
-        ("\v", r"\v")  # Vertical Tab
-]
+import copy, inspect, re, select, socket, threading, time
+from collections import Counter, deque
+from Exceptions   import IllegalStateException, TS3Exception
+from Metrics      import Metrics
+from FloodControl import TokenBucket, DEFAULT_FLOOD_COMMANDS, DEFAULT_FLOOD_TIME, FLOOD_ERROR_ID
+from TS3_Codec    import TS3_ESCAPE, encode, decode, parseMap, parseMapBytes
+from TS3_Records  import toRecords
+
+RECEIVE_SIZE = 65536 #Bytes asked of the socket at a time.
+
+ROW_END = re.compile(rb"\||\n\r") #Rows of a list response are delimited by "|" and the whole response is terminated by "\n\r".
+
+CACHE_TTLS = { #Seconds the responses of these slow changing commands are reused for before being requested again.
+        "serverinfo"             : 30,
+        "servergrouplist"        : 300,
+        "servergroupclientlist"  : 60,
+        "servergroupsbyclientid" : 60,
+        "channellist"            : 60,
+        "channelgrouplist"       : 300,
+        "whoami"                 : 10
+}
+
+CACHE_INVALIDATED_BY = { #Commands that change what a cached command would return, and the cached commands they make stale.
+        "use"                  : list(CACHE_TTLS), #A different virtual server, nothing cached applies any more.
+        "servergroupaddclient" : ["servergroupclientlist", "servergroupsbyclientid"],
+        "servergroupdelclient" : ["servergroupclientlist", "servergroupsbyclientid"],
+        "channelmove"          : ["channellist"],
+        "channeldelete"        : ["channellist", "serverinfo"],
+        "clientkick"           : ["serverinfo"],
+        "banclient"            : ["serverinfo"],
+        "clientmove"           : ["whoami"],
+        "clientupdate"         : ["whoami"]
+}
+
+IDEMPOTENT_COMMANDS = { #Commands that change nothing, so are safe to send again if the connection dropped before they were answered.
+        "version", "whoami", "instanceinfo", "serverinfo", "serverlist",
+        "channellist", "channelinfo", "channelgrouplist", "channelgroupclientlist",
+        "clientlist", "clientinfo", "clientdblist",
+        "servergrouplist", "servergroupclientlist", "servergroupsbyclientid"
+}
+
+CLIENTLIST_FLAGS = { #The options of "clientlist" and the fields each adds to its rows, on top of clid, cid, client_database_id, client_nickname and client_type.
+        "-uid"     : ["client_unique_identifier"],
+        "-away"    : ["client_away", "client_away_message"],
+        "-voice"   : ["client_flag_talking", "client_input_muted", "client_output_muted", "client_input_hardware", "client_output_hardware",
+                      "client_talk_power", "client_is_talker", "client_is_priority_speaker", "client_is_recording", "client_is_channel_commander"],
+        "-times"   : ["client_idle_time", "client_created", "client_lastconnected"],
+        "-groups"  : ["client_servergroups", "client_channel_group_id", "client_channel_group_inherited_channel_id"],
+        "-info"    : ["client_version", "client_platform"],
+        "-country" : ["client_country"],
+        "-ip"      : ["connection_client_ip"],
+        "-icon"    : ["client_icon_id"],
+        "-badges"  : ["client_badges"]
+}
+
+CONNECTION_ERRORS = (OSError, EOFError) #What a dropped or timed out connection looks like; socket.timeout and ConnectionError are both OSErrors.
 
 class TS3_API:
 
-    #TS3 has an anti-flood system. This number defines the time this application will sleep between consecutive requests in some functions.
-    sleep_time = 0
+    #TS3 has an anti-flood system. Every command waits on flood_control (a FloodControl.TokenBucket, or None when whitelisted) before it is sent.
+    flood_control = None
+    flood_pending = None #(commands, period) to be read from the server once we've logged in, if configureFloodControl was called before we could ask.
+    flood_retries = 3 #How many times a command the server rejected for flooding is retried after backing off.
 
-    conn = None
+    #Seconds to wait on the socket before giving up on the connection. A reply can't be late forever, nor a write stuck behind a full buffer.
+    read_timeout = 60
+    write_timeout = 10
+
+    #ServerQuery drops connections idle for 10 minutes. A "version" is sent after this many seconds without a command, None to never.
+    keepalive_interval = 240
+
+    auto_reconnect = True #Whether a dropped connection is reopened (and idempotent commands retried) rather than raised.
+
+    #Set to True to have clients, channels, server groups and server info returned as TS3_Records (typed values, no per-row dictionary) rather than dictionaries of strings.
+    typed = False
+
+    conn = None             #The socket connected to the server.
+    buffer = None           #Bytes received from the server but not yet consumed.
+    chunk = None            #What each recv_into fills, reused for every read; chunk_view is a memoryview of it.
+    chunk_view = None
+    pending_response = None #A submitCommandIter response the caller has not finished reading.
+    notifications = None    #(event, data) pairs received from the server since they were last polled for.
+    registrations = None    #The servernotifyregister commands we've issued.
+    last_sent = 0           #time.monotonic() of the last command sent, for the keep-alive.
     is_Connected = False
     is_Authenticated = False
 
     clid = -1 #This ServerQuery instance's client ID.
     chid = -1 #The ID of the channel this instance currently resides in.
 
+    def __init__(self):
+        self.flood_control = TokenBucket() #Assume TS3's default limits until told otherwise, see configureFloodControl.
+        self.notifications = deque()
+        self.registrations = []
+
+        self.lock = threading.RLock()   #Held whilst using the connection, so the keep-alive never interleaves with a caller's command.
+        self.keepalive = None           #The keep-alive thread...
+        self.keepalive_stop = None      #...and the event that stops it.
+        self.session = None             #What to replay on reconnect; address, port, sid and the login's username, password and nickname.
+        self.reconnecting = False
+
+        self.metrics = Metrics()
+        self.receiving = None #Verb of the command whose response is being read, for self.metrics.
+
+        self.cache_ttls = dict(CACHE_TTLS)
+        self.cache = {}                #Command -> {"expires": ..., "result": ..., "indexes": {...}}
+        self.cache_hits = Counter()    #Command verb -> number of times it was answered from the cache...
+        self.cache_misses = Counter()  #...and the number of times it had to be sent.
+
     ###############################################################################
     ##################### Networking/IO Functionalities ###########################
     ###############################################################################
 
     def connect(self, address, port, sid=1):
-        """ Connect to a target TS3 server via telnet connection. """
+        """ Connect to a target TS3 server and select virtual server sid, or none if sid is None (IE. to find them with "serverlist" first). """
 
-        self.conn = telnetlib.Telnet(address, port)
+        self.conn = socket.create_connection((address, port), self.read_timeout)
+        self.buffer = bytearray()
+        if self.chunk is None:
+            self.chunk = bytearray(RECEIVE_SIZE)
+            self.chunk_view = memoryview(self.chunk)
+        self.pending_response = None
+        self.session = {"address": address, "port": port, "sid": sid, "username": None}
+        self.receiving = "connect" #The welcome message.
 
         if (
-            self.conn.read_until(b"\n\r") == b"TS3\n\r" and
-            self.conn.read_until(b"\n\r") != b""
+            self.readLine() == b"TS3" and
+            self.readLine() != b""
         ):
             self.is_Connected = True
-            self.changeSID(sid) #Select virtual server
+            if sid is not None:
+                self.changeSID(sid) #Select virtual server
         else:
             raise ConnectionError("An unknown connection error occurred and we could not verify a connection to the server. You're likely flood banned or the server is down.")
 
+        if self.keepalive_interval and not self.reconnecting:
+            self.startKeepAlive()
+
     def disconnect(self):
-        """ Disconnect from the current TS3 server and close the telnet connection. """
+        """ Disconnect from the current TS3 server and close the connection. """
 
         if not self.is_Connected:
             raise IllegalStateException("Not connected to a server; Cannot disconnect!")
 
+        self.stopKeepAlive()
+        self.session = None #We're on our way out, a dropped connection is as good as closed.
+
         try: #Attempt to logout
             self.logout()
         except IllegalStateException:
@@ -80,67 +174,557 @@ class TS3_API:
         if not self.is_Connected:
             raise IllegalStateException("Not connected to a server; Cannot submit command!")
 
-        self.conn.write((command + "\n\r").encode()) #Encode and transmit command.
+        with self.lock:
+            try:
+                return self.exchange(command)
+            except CONNECTION_ERRORS as e:
+                self.recover(e, [command])
+                return self.exchange(command) #Sent once more, a second failure is raised to the caller.
+
+    def exchange(self, command):
+        """ Sends a command and reads its response, retrying it whilst the server rejects it for flooding. """
+
+        self.finishPendingResponse()
+
+        for attempt in range(self.flood_retries + 1):
+
+            self.send(command)
+            self.receiving = command.split(" ", 1)[0]
+            sent_at = self.last_sent
+
+            try:
+                return self.convert(command, self.getResponse()) #Get and return response.
+            except TS3Exception as e:
+                if not self.isFlooding(e) or attempt == self.flood_retries:
+                    raise e
+                self.flood_control.backoff(e.extra_msg, attempt) #Slow down and try again.
+            finally:
+                self.metrics.roundTrip(self.receiving, time.monotonic() - sent_at)
+
+    def send(self, command):
+        """ Waits for the flood control's go-ahead, then encodes and transmits a command. """
+
+        if self.flood_control is not None:
+            self.metrics.floodWait(self.flood_control.acquire())
+
+        verb = command.split(" ", 1)[0]
+        if verb in CACHE_INVALIDATED_BY:
+            self.invalidateCache(*CACHE_INVALIDATED_BY[verb])
+
+        data = (command + "\n\r").encode()
+        self.conn.settimeout(self.write_timeout)
+        try:
+            self.conn.sendall(data)
+        finally:
+            self.conn.settimeout(self.read_timeout)
+
+        self.last_sent = time.monotonic()
+        self.metrics.sent(verb, len(data))
+
+    def recover(self, error, commands):
+        """
+            Called when the connection failed whilst commands were in flight. Reconnects, then returns if every one of them is safe to send again
+            (see IDEMPOTENT_COMMANDS), otherwise raises; they may or may not have been carried out and only the caller can decide what to do about that.
+        """
+
+        if not self.auto_reconnect or self.reconnecting or self.session is None:
+            raise error
+
+        self.reconnect()
+
+        unsafe = [command for command in commands if command.split(" ", 1)[0] not in IDEMPOTENT_COMMANDS]
+        if unsafe:
+            raise ConnectionError("The connection to the server was lost (" + str(error) + ") whilst sending \"" + unsafe[0] + "\", it may not have been carried out. We've since reconnected.") from error
+
+    def reconnect(self):
+        """ Replace the connection with a fresh one, restoring the virtual server, login, nickname and notification registrations of the old. """
+
+        session = dict(self.session) #connect() starts a new one.
+
+        try:
+            self.conn.close()
+        except (AttributeError, OSError):
+            pass
+
+        self.reconnecting = True #A failure whilst reconnecting is raised, not reconnected from.
+        try:
+            self.is_Connected = False
+            self.is_Authenticated = False
+            self.invalidateCache() #Our client ID and channel are about to change.
+
+            self.connect(session["address"], session["port"], session["sid"])
+            if session["username"] is not None:
+                self.login(session["username"], session["password"], session["nickname"])
+
+            for command in self.registrations:
+                self.submitCommand(command)
+        finally:
+            self.reconnecting = False
+
+    def startKeepAlive(self, interval=None):
+        """ Start a background thread that sends a "version" whenever the connection has been idle for interval (default keepalive_interval) seconds. """
+
+        self.stopKeepAlive()
+
+        self.keepalive_interval = interval or self.keepalive_interval
+        self.keepalive_stop = threading.Event()
+        self.keepalive = threading.Thread(target=self.keepAlive, args=(self.keepalive_stop,), name="TS3_API keep-alive", daemon=True)
+        self.keepalive.start()
+
+    def stopKeepAlive(self):
+
+        if self.keepalive is not None:
+            self.keepalive_stop.set()
+            if self.keepalive is not threading.current_thread():
+                self.keepalive.join()
+            self.keepalive = None
+            self.keepalive_stop = None
+
+    def keepAlive(self, stop):
+        """ Body of the keep-alive thread. """
+
+        while not stop.wait(max(self.last_sent + self.keepalive_interval - time.monotonic(), 1)):
+            with self.lock:
+                if stop.is_set() or not self.is_Connected or not self.isIdle():
+                    continue
+                try:
+                    self.submitCommand("version")
+                except (TS3Exception, *CONNECTION_ERRORS):
+                    pass #Couldn't reconnect either, the next command will find out for itself.
+
+    def isIdle(self):
+        """ Whether we're due a keep-alive; nothing sent for keepalive_interval seconds and no streamed response still being read. """
+
+        if self.pending_response is not None and inspect.getgeneratorstate(self.pending_response) != inspect.GEN_CLOSED:
+            return False
+        return time.monotonic() - self.last_sent >= self.keepalive_interval
+
+    def isFlooding(self, result):
+        """ Whether a result is the server rejecting a command because we're flooding it, and flood control can do something about it. """
+        return self.flood_control is not None and isinstance(result, TS3Exception) and int(result.error_ID) == FLOOD_ERROR_ID
+
+    def configureFloodControl(self, whitelisted=False, commands=None, period=None):
+        """
+            Set the rate at which commands are sent. Whitelisted connections are exempt from TS3's flood protection, so they're not limited at all.
+            Otherwise allow commands commands per period seconds; either left as None is read from the server's own limits,
+            which requires permission to use "instanceinfo", falling back to TS3's defaults.
+
+            Best called before connect(), so connecting and logging in are paced as they should be (or not at all if whitelisted).
+            Limits to be read from the server are then read by login(), TS3's defaults applying until then.
+        """
+
+        self.flood_pending = None
+
+        if whitelisted:
+            self.flood_control = None
+            return
+
+        if commands is None or period is None:
+
+            if not self.is_Connected: #Nobody to ask yet.
+                self.flood_pending = (commands, period)
+                self.flood_control = self.flood_control or TokenBucket()
+                return
+
+            try:
+                instance_info = self.submitCommand("instanceinfo") or {}
+            except TS3Exception: #Most likely insufficient permissions.
+                instance_info = {}
+
+            commands = commands or int(instance_info.get("serverinstance_serverquery_flood_commands", DEFAULT_FLOOD_COMMANDS))
+            period = period or int(instance_info.get("serverinstance_serverquery_flood_time", DEFAULT_FLOOD_TIME))
+
+        self.flood_control = TokenBucket(commands, period).takeOver(self.flood_control) #What we've just sent still counts.
+
+    def submitCommands(self, commands, window=64):
+        """
+            Pipelined variant of submitCommand. Transmits the commands back-to-back without waiting on each reply,
+            then matches the stream of replies to their commands in order.
+
+            Returns a list the same length as commands, holding either each command's response or the TS3Exception it raised.
+            At most window commands are left unanswered at any time so neither side's socket buffer can fill up and stall us.
+        """
+
+        if not self.is_Connected:
+            raise IllegalStateException("Not connected to a server; Cannot submit commands!")
+
+        with self.lock:
+            try:
+                return self.exchangeAll(commands, window)
+            except CONNECTION_ERRORS as e:
+                self.recover(e, commands)
+                return self.exchangeAll(commands, window)
+
+    def exchangeAll(self, commands, window):
+        """ Pipelines the commands, then sends again any the server rejected for flooding. See submitCommands. """
+
+        self.finishPendingResponse()
+        results = self.pipeline(commands, window)
+
+        #Commands rejected for flooding are sent again once we've backed off. They may now complete after commands that followed them.
+        for attempt in range(self.flood_retries):
+
+            flooded = [i for (i, result) in enumerate(results) if self.isFlooding(result)]
+            if not flooded:
+                break
+
+            self.flood_control.backoff(results[flooded[0]].extra_msg, attempt)
+            for (i, result) in zip(flooded, self.pipeline([commands[i] for i in flooded], window)):
+                results[i] = result
+
+        return results
+
+    def pipeline(self, commands, window):
+        """ Sends the commands with at most window of them awaiting a response at once, collecting the responses (or exceptions) in order. """
+
+        results = []
+        sent_at = [] #When each command went out, for its round trip time.
+
+        while len(results) < len(commands):
+
+            #Top up the pipe until there are window commands awaiting a response.
+            while len(sent_at) < len(commands) and len(sent_at) - len(results) < window:
+                self.send(commands[len(sent_at)])
+                sent_at.append(self.last_sent)
+
+            command = commands[len(results)]
+            self.receiving = command.split(" ", 1)[0]
+
+            try: #Responses arrive in the order the commands were sent.
+                results.append(self.convert(command, self.getResponse()))
+            except TS3Exception as e:
+                results.append(e) #A failed command doesn't affect the others, hand its exception back in its place.
+
+            self.metrics.roundTrip(self.receiving, time.monotonic() - sent_at[len(results) - 1])
+
+        return results
+
+    def submitCommandIter(self, command):
+        """
+            Streaming variant of submitCommand for commands with potentially huge list responses (clientdblist, channellist...).
+            Transmits the command straight away and returns an iterator that parses and yields each row of the response as it comes off the socket,
+            so only a single row is ever held in memory.
+
+            The iterator may be abandoned early. The remainder of the response is then discarded, either when the iterator is closed
+            or before the next command is submitted.
+        """
+
+        if not self.is_Connected:
+            raise IllegalStateException("Not connected to a server; Cannot submit command!")
+
+        with self.lock:
+            try:
+                self.finishPendingResponse()
+                self.send(command)
+            except CONNECTION_ERRORS as e:
+                self.recover(e, [command])
+                self.send(command)
+
+            self.pending_response = self.iterResponse(command, self.last_sent)
+            return self.pending_response
+
+    def finishPendingResponse(self):
+        """ Discard whatever remains of a response still being streamed by submitCommandIter, so the next command reads its own response. """
+
+        if self.pending_response is not None:
+            if inspect.getgeneratorstate(self.pending_response) == inspect.GEN_CREATED: #Never started, so none of it has been read.
+                if not self.readLine().startswith(b"error id="):
+                    self.readLine()
+            self.pending_response.close() #Closing a started generator drains the rest of its response from the pipe.
+            self.pending_response = None
+
+    def iterResponse(self, command, sent_at):
+        """
+            Generator that parses the response to command row by row straight out of the receive buffer. See submitCommandIter.
+            The command's round trip is timed to its first row (or error), however long the caller then takes over the rows.
+        """
 
-        return self.getResponse() #Get and return response.
+        finished = False
+        verb = command.split(" ", 1)[0]
+        parse_time = 0
+
+        try:
+            self.receiving = verb
+            try:
+                self.skipNotifications()
+                row = self.readRow()
+            except CONNECTION_ERRORS as e: #Nothing has been yielded yet, so if it's safe to (see recover) we send the command again once.
+                finished = True #There's nothing left to drain from a dead connection.
+                with self.lock:
+                    response = self.pending_response #Reconnecting forgets it.
+                    self.recover(e, [command])
+                    self.send(command)
+                    self.pending_response = response
+                sent_at = self.last_sent
+                finished = False
+                self.skipNotifications()
+                row = self.readRow()
+
+            self.metrics.roundTrip(verb, time.monotonic() - sent_at)
+            attempt = 0
+
+            while row.startswith(b"error id="): #No data, the command went straight to its error/OK line.
+
+                finished = True
+                del self.buffer[:2]
+
+                try:
+                    self.raiseError(row)
+                    return
+                except TS3Exception as e:
+                    if not self.isFlooding(e) or attempt == self.flood_retries:
+                        raise e
+
+                    self.flood_control.backoff(e.extra_msg, attempt) #Slow down and try again.
+                    attempt += 1
+
+                    self.send(command)
+                    sent_at = self.last_sent
+                    finished = False
+                    self.skipNotifications()
+                    row = self.readRow()
+                    self.metrics.roundTrip(verb, time.monotonic() - sent_at)
+
+            while True:
+
+                if row: #An empty data line means an empty list.
+                    started = time.perf_counter()
+                    parsed = self.convert(command, parseMapBytes(row))
+                    parse_time += time.perf_counter() - started
+                    yield parsed
+
+                if self.buffer.startswith(b"\n\r"): #That was the last row.
+                    del self.buffer[:2]
+                    break
+
+                del self.buffer[:1] #Drop the "|" ahead of the next row.
+                row = self.readRow()
+
+            finished = True
+            self.metrics.parsed(verb, parse_time)
+            self.getResponse() #Purge OK response from pipe
+
+        finally:
+            if not finished: #Abandoned part way through; skip to the end of the data line, then the OK/error line.
+                try:
+                    self.readRawLine()
+                    self.readLine()
+                except CONNECTION_ERRORS:
+                    pass #Whatever went wrong is raised (or the next command reconnects), the rest of the response is gone either way.
+
+    def readRow(self):
+        """ Returns the bytes up to (but not including) the next row delimiter, leaving the delimiter at the front of the buffer. """
+
+        scan = 0
+        while True:
+            match = ROW_END.search(self.buffer, scan)
+            if match is not None:
+                return self.take(match.start())
+            scan = max(len(self.buffer) - 1, 0) #The "\n" of a "\n\r" may already be buffered.
+            self.receive()
+
+    def readLine(self):
+        """ Returns the next line from the server, without its "\n\r" terminator. Notifications are queued for pollNotifications rather than returned. """
+
+        while True:
+            line = self.readRawLine()
+            if not line.startswith(b"notify"):
+                return line
+            self.queueNotification(line)
+
+    def skipNotifications(self):
+        """ Queues any notifications at the front of the receive buffer, for when the next line is to be read row by row rather than with readLine. """
+
+        while True:
+            while len(self.buffer) < len(b"notify"):
+                self.receive()
+            if not self.buffer.startswith(b"notify"):
+                return
+            self.queueNotification(self.readRawLine())
+
+    def readRawLine(self):
+        """ Returns the bytes up to the next "\n\r" terminator, consuming the terminator. """
+
+        scan = 0
+        while True:
+            pos = self.buffer.find(b"\n\r", scan)
+            if pos != -1:
+                return self.take(pos, 2)
+            scan = max(len(self.buffer) - 1, 0) #Only what's new is searched. The "\n" of a "\n\r" may already be buffered.
+            self.receive()
+
+    def take(self, length, skip=0):
+        """ Removes and returns the first length bytes of the receive buffer, copied out once, then discards skip bytes more (IE. a delimiter). """
+
+        with memoryview(self.buffer) as view:
+            data = view[:length].tobytes()
+        del self.buffer[:length + skip] #Cheap, a bytearray drops bytes off its front without moving the rest.
+        return data
+
+    def receive(self):
+        """ Blocks until more data arrives from the server and appends it to the receive buffer. """
+
+        size = self.conn.recv_into(self.chunk)
+        if not size:
+            raise ConnectionError("The server closed the connection.")
+        self.buffer += self.chunk_view[:size]
+        self.metrics.received(self.receiving, size)
+
+    def queueNotification(self, line):
+        """ Splits a notification such as "notifyclientleftview cfid=1 ctid=0 clid=5" into its event name and data, and queues it for pollNotifications. """
+
+        (event, _, data) = line.partition(b" ")
+        event = event.decode()
+        rows = [parseMapBytes(row) for row in data.split(b"|")] #Several clients may share one notification...
+        for row in rows:
+            self.notifications.append((event, self.convert(event, dict(rows[0], **row)))) #...with the keys they share (IE. "ctid") only in the first row.
+
+    def pollNotifications(self, timeout=0):
+        """
+            Returns the list of (event, data) notifications received since the last poll, waiting up to timeout seconds for one to arrive if there are none yet.
+            See registerNotifications.
+        """
+
+        with self.lock:
+            try:
+                self.waitForNotifications(timeout)
+            except CONNECTION_ERRORS as e:
+                self.recover(e, []) #Registrations are replayed, though anything that happened whilst we were away is lost.
+
+            events = list(self.notifications)
+            self.notifications.clear()
+            return events
+
+    def waitForNotifications(self, timeout):
+        """
+            Reads until a notification is queued or timeout seconds pass. The keep-alive thread can't get a word in whilst we hold the connection,
+            so the keep-alive is sent from here instead when the wait runs long.
+        """
+
+        if self.conn.fileno() == -1: #Closed by a reconnect that failed, see whether the server's back.
+            raise ConnectionError("The connection to the server is closed.")
+
+        self.finishPendingResponse() #Its response would otherwise be mistaken for unsolicited lines.
+        self.receiving = "notify"
+        deadline = time.monotonic() + timeout
+
+        while not self.notifications:
+
+            if b"\n\r" in self.buffer: #A whole line is already waiting.
+                line = self.readRawLine()
+                if line.startswith(b"notify"):
+                    self.queueNotification(line)
+                continue
+
+            if self.keepalive_interval and self.isIdle():
+                self.exchange("version") #Notifications arriving ahead of its response are queued as usual.
+                continue
+
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            wait = deadline - now
+            if self.keepalive_interval:
+                wait = min(wait, self.last_sent + self.keepalive_interval - now)
+
+            if select.select([self.conn], [], [], max(wait, 0))[0]:
+                self.receive()
+
+    def convert(self, command, result):
+        """ The parsed response to command as records if we're typed and the command has a record type (see TS3_Records.COMMAND_RECORDS). """
+        return toRecords(command, result) if self.typed else result
+
+    def raiseError(self, raw_error):
+        """ Parses an "error id=... msg=..." line, raising it as a TS3Exception unless it reports success. """
+
+        error_report = parseMapBytes(raw_error[6:].strip())     #Retrieve the error and parse it
+        if error_report["id"] != "0":                           #If it was not an OK response...
+            self.metrics.error(self.receiving, error_report["id"])
+            raise TS3Exception(error_report["msg"], error_report["id"], error_report.get("extra_msg")) #...raise it as an exception to the calling function.
 
     def getResponse(self):
         """ Listens for and returns a response from the server after a command is exectued. """
 
-        raw_response = self.conn.read_until(b"\n\r").decode().strip() #Collect from pipe until terminating character is read.
+        raw_response = self.readLine().strip() #Collect from pipe until terminating character is read. Parsed as bytes, only the values are decoded.
 
         #Check for OK response from pipe.
-        if(raw_response[:5] == "error"):
-            error_report = self.parseMap(raw_response[6:])  #Retrieve the error and parse it
-            if error_report["id"] is not "0":               #If it was not an OK response...
-                raise TS3Exception(error_report["msg"], error_report["id"]) #...raise it as an exception to the calling function.
+        if raw_response.startswith(b"error"):
+            self.raiseError(raw_response) #Raised to the calling function if it was not an OK response...
             return None #Otherwise just ignore it.
 
-        #Is the response a list?
-        if "|" in raw_response:
-            values = [self.parseMap(x) for x in raw_response.split('|')] #Parse all elements of the list
-            self.getResponse() #Purge OK response from pipe
-            return values
+        started = time.perf_counter()
 
+        #Is the response a list?
+        if b"|" in raw_response:
+            values = [parseMapBytes(x) for x in raw_response.split(b"|")] #Parse all elements of the list
         else: #It was just a map!
-            self.getResponse() #Purge OK response from pipe
-            return self.parseMap(raw_response)
+            values = parseMapBytes(raw_response)
 
-    def parseMap(self, raw_string):
-        """
-            Function that turns the formatted map-like string response of a TS3 server into a python dictionary/map/associate array/what you wish to call it.
+        self.metrics.parsed(self.receiving, time.perf_counter() - started)
+        self.getResponse() #Purge OK response from pipe
+        return values
 
-            Example Input: virtualserver_status=unknown virtualserver_unique_identifier virtualserver_port=0 virtualserver_id=0 client_id=0
-            Example Output: {"virtualserver_status" : "unknown", "virtualserver_unique_identifier" : None, "virtualserver_port" : "0", "virtualserver_id" : "0", "client_id" : "0"}
+    def cachedCommand(self, command):
+        """
+            submitCommand for slow changing commands (see CACHE_TTLS). The response is reused until it's older than the command's TTL,
+            or until a command that changes it is sent (see CACHE_INVALIDATED_BY). Callers get their own copy to modify as they please.
         """
 
-        dic = {}
-        for ele in raw_string.split(" "): #Key value pairs are delimited by spaces (" "). Iterate over the key value pairs...
+        return copy.deepcopy(self.cacheEntry(command)["result"])
 
-            pos = ele.find('=') #Elements are of the form "key=value". Not as simple as "dic + ele.split("=")", value may contain "=" as it is not a reserved character.
+    def cacheEntry(self, command):
+        """ command's entry in the cache, sending it first if it's missing or has expired. The entry's response is shared, not a copy. """
 
-            if pos != -1:
-                dic[ele[:pos]] = self.decode(ele[pos+1:]) #dic[key] = value
-            else:
-                dic[ele] = None #No "=" present means this key had no associated value and should therefore be None.
+        verb = command.split(" ", 1)[0]
+        entry = self.cache.get(command)
 
-        return dic
+        if entry is not None and entry["expires"] > time.monotonic():
+            self.cache_hits[verb] += 1
+        else:
+            self.cache_misses[verb] += 1
+            entry = {"expires": time.monotonic() + self.cache_ttls.get(verb, 0), "result": self.submitCommand(command), "indexes": {}}
+            self.cache[command] = entry
 
-    def encode(self, s):
-        """ Utilizes TS3_ESCAPE to replace any/all characters reserved by TS3 for formatting transmissions/response into their safe escape character counterparts. """
+        return entry
 
-        for (py_char, sq_char) in TS3_ESCAPE: #For each character pair in the list...
-            s = s.replace(py_char, sq_char)   #...replace the normal character with it's ServerQuery escape character.
+    def cachedIndex(self, command, key):
+        """ The rows of a cached list command indexed by key (str of the key's value -> list of rows, whether typed or not), built once per cached response. """
 
-        return s
+        entry = self.cacheEntry(command) #Fresh, and without copying the whole response just to look a row up.
 
-    def decode(self, s):
-        """ Utilizes TS3_ESCAPE to replace any/all TS3 escape characters back into their normal characters. """
+        if key not in entry["indexes"]:
+            rows = entry["result"] if isinstance(entry["result"], list) else [entry["result"]] #Lists of one come back as just the map.
+            index = {}
+            for row in rows:
+                index.setdefault(str(row.get(key)), []).append(row)
+            entry["indexes"][key] = index
+
+        return entry["indexes"][key]
+
+    def invalidateCache(self, *verbs):
+        """ Forget cached responses of the given command verbs, or of everything if none are given. """
+
+        for command in list(self.cache):
+            if not verbs or command.split(" ", 1)[0] in verbs:
+                del self.cache[command]
 
-        for (py_char, sq_char) in reversed(TS3_ESCAPE): #For each character pair in the REVERSED ORDER of the list...
-            s = s.replace(sq_char, py_char)             #...replace the ServerQuery escape character with it's normal character.
+    def parseMap(self, raw_string):
+        """
+            Function that turns the formatted map-like string response of a TS3 server into a python dictionary/map/associate array/what you wish to call it.
 
-        return s
+            Example Input: virtualserver_status=unknown virtualserver_unique_identifier virtualserver_port=0 virtualserver_id=0 client_id=0
+            Example Output: {"virtualserver_status" : "unknown", "virtualserver_unique_identifier" : None, "virtualserver_port" : "0", "virtualserver_id" : "0", "client_id" : "0"}
+        """
+        return parseMap(raw_string)
+
+    def encode(self, s):
+        """ Replace any/all characters reserved by TS3 for formatting transmissions/response into their safe escape character counterparts. See TS3_Codec. """
+        return encode(s)
+
+    def decode(self, s):
+        """ Replace any/all TS3 escape characters back into their normal characters. See TS3_Codec. """
+        return decode(s)
 
     ###############################################################################
     ############################ Server Query Commands ############################
@@ -153,7 +737,10 @@ class TS3_API:
             raise IllegalStateException("Not connected to a server; Cannot login!")
 
         self.submitCommand("login " + username + " " + password) #Authenticate
-        self.submitCommand("clientupdate client_nickname=" + (self.encode(nickname) if nickname is not None else self.encode(username))) #Change nickname to username.
+        if self.session is not None: #Remembered so a reconnect can log back in.
+            self.session.update(username=username, password=password, nickname=nickname)
+        if self.session is None or self.session["sid"] is not None: #Otherwise there's no client to rename yet, changeSID names it.
+            self.submitCommand("clientupdate client_nickname=" + (self.encode(nickname) if nickname is not None else self.encode(username))) #Change nickname to username.
             #Update meta-data
         wai = self.submitCommand("whoami")
         (self.clid, self.chid) = (wai['client_id'], wai['client_channel_id'])
@@ -162,6 +749,9 @@ class TS3_API:
             self.is_Connected = True
             self.is_Authenticated = True
 
+        if self.flood_pending is not None: #configureFloodControl was waiting on us to be able to read the server's limits.
+            self.configureFloodControl(False, *self.flood_pending)
+
     def logout(self):
         """ Logout and return to the default ServerQuery user group. """
 
@@ -171,30 +761,63 @@ class TS3_API:
         self.submitCommand("logout")
         self.is_Authenticated = False
 
+    def registerNotifications(self, event, channelID=None):
+        """
+            Ask the server to send us notifications of an event ("server", "channel", "textserver", "textchannel" or "textprivate").
+            Channel events are for channelID, 0 meaning every channel. Notifications are collected with pollNotifications.
+        """
+
+        command = "servernotifyregister event=" + event + (" id=" + str(channelID) if channelID is not None else "")
+        self.submitCommand(command)
+        self.registrations.append(command)
+
+    def unregisterNotifications(self):
+        """ Stop receiving all notifications. """
+
+        self.submitCommand("servernotifyunregister")
+        self.registrations = []
+
     def changeSID(self, sid):
-        """ Change what virtual server the ServerQuery instance is operating on. """
-        self.submitCommand("use sid=" + str(sid))
+        """ Change what virtual server the ServerQuery instance is operating on. Once logged in, our nickname comes with us. """
+
+        nickname = None
+        if self.session is not None and self.session["username"] is not None:
+            nickname = self.session["nickname"] if self.session["nickname"] is not None else self.session["username"]
+
+        self.submitCommand("use sid=" + str(sid) + (" client_nickname=" + self.encode(nickname) if nickname is not None else ""))
+        if self.session is not None:
+            self.session["sid"] = sid
 
     def getServerInfo(self):
-        return self.submitCommand("serverinfo")
+        return self.cachedCommand("serverinfo")
 
     def getServerList(self):
         return self.submitCommand("serverlist")
 
-    def getChannelList(self):
-        return self.submitCommand("channellist")
+    def getChannelList(self, lazy=False):
+        """ Request the list of channels. Set lazy to True to get an iterator that yields channels as they are received instead of a list. """
+        return self.submitCommandIter("channellist") if lazy else self.cachedCommand("channellist")
+
+    def getChannelByName(self, name):
+        """ Look up a channel by its name, or None if there isn't one. """
+        channels = self.cachedIndex("channellist", "channel_name").get(name)
+        return channels[0].copy() if channels else None
+
+    def getChildChannels(self, parentChannelID):
+        """ The channels directly beneath a channel, 0 being the top level. """
+        return [x.copy() for x in self.cachedIndex("channellist", "pid").get(str(parentChannelID), [])]
 
     def getChannelInfo(self, channelID):
         return self.submitCommand("channelinfo cid=" + str(channelID))
 
     def moveChannel(self, targetChannelID, parentChannelID, orderID=None):
-        return self.submitCommand("channelmove cid=" + str(targetChannelID) + " cpid=" + str(parentChannelID) + ("order=" + orderID) if orderID != None else "")
+        return self.submitCommand("channelmove cid=" + str(targetChannelID) + " cpid=" + str(parentChannelID) + (" order=" + str(orderID) if orderID is not None else ""))
 
     def deleteChannel(self, channelID, force=True):
-        return self.submitCommand("channeldelete cid=" + str(channelID) + " force=1" if force else "");
+        return self.submitCommand("channeldelete cid=" + str(channelID) + " force=" + ("1" if force else "0"))
 
     def getChannelGroups(self):
-        return self.submitCommand("channelgrouplist")
+        return self.cachedCommand("channelgrouplist")
 
     def getChannelGroupMembers(self, channelGroupID):
         return self.submitCommand("channelgroupclientlist cgid=" + channelGroupID)
@@ -209,35 +832,92 @@ class TS3_API:
     def setChannelGroup(self, clientDBID, channelGroupID, channelID):
         return self.submitCommand("setclientchannelgroup cldbid=" + str(clientDBID) + " cid=" + str(channelID) + " cgid=" + channelGroupID)
 
-    def getConnectedClients(self, detailed=False):
-        """ Request a list of the clients currently connected to the server. Set detailed to True if you require more detailed information than what TS3's "clientlist" command provides. """
-        clients = self.submitCommand("clientlist")
+    def getConnectedClients(self, detailed=False, pool=None, fields=None):
+        """
+            Request a list of the clients currently connected to the server. Set detailed to True if you require more detailed information than what TS3's "clientlist" command provides.
+            The follow up requests for detailed information are spread across the sessions of pool (a TS3_Pool) if one is given.
+            Alternatively give fields, the names of the fields you need, to get as many of them as "clientlist"'s options (see CLIENTLIST_FLAGS) can provide in the one request.
+            Those it can't (IE. "connection_connected_time", "client_totalconnections") are left to fillClientInfo, for just the clients that turn out to need them.
+        """
+        options = [] if fields is None else [flag for (flag, provided) in CLIENTLIST_FLAGS.items() if not set(provided).isdisjoint(fields)]
+        clients = self.submitCommand(" ".join(["clientlist"] + options))
+        clients = clients if isinstance(clients, list) else [clients] #Lists of one (IE. just us on an empty server) come back as just the map.
 
         if detailed: #User asked for detailed client information that requires a follow up request for each client.
+            for client in self.fillClientInfo(clients, pool=pool):
+                clients.remove(client) #PURGE!
 
-            disconnected = [] #Clients that disconnected whilst this funciton was executing. We'll purge them before returning.
+        return clients
 
-            for client in clients:
-                try:
-                    time.sleep(self.sleep_time)                         #Sleep to prevent flood ban.
-                    client.update(self.getClientInfo(client["clid"]))   #Update the dictionary with the additional values.
-                except TS3Exception as e:
-                    if e.error_ID is 512: #512 is "client could not be targeted", IE. they logged out.
-                        disconnected.append(client) #...append them into a list to purge later.
-                    else:
-                        raise e #otherwise raise the exception as something bad happened.
+    def fillClientInfo(self, clients, fields=None, pool=None):
+        """
+            Update clients (rows of "clientlist") with the details of their "clientinfo"; only those missing any of fields, or every client if fields is None.
+            The requests are pipelined, and spread across the sessions of pool (a TS3_Pool) if one is given.
+            Returns the clients that disconnected in the meantime, who are left as they were.
+        """
+        wanted = [client for client in clients if fields is None or any(field not in client for field in fields)]
+        disconnected = []
+
+        #Pipeline a "clientinfo" for every client rather than waiting out a round trip for each.
+        infos = (pool or self).submitCommands(["clientinfo clid=" + str(client["clid"]) for client in wanted])
+
+        for (client, info) in zip(wanted, infos):
+            if isinstance(info, TS3Exception):
+                if int(info.error_ID) == 512: #512 is "client could not be targeted", IE. they logged out.
+                    disconnected.append(client)
+                else:
+                    raise info #otherwise raise the exception as something bad happened.
+            else:
+                client.update(info) #Update the dictionary with the additional values.
 
-            for client in disconnected:
-                clients.remove(client) #PURGE!
+        return disconnected
 
-        return clients
+    def getAllClients(self, lazy=False):
+        """
+            Requests a list of EVERY client (incl. offline ones) from the database.
+            Set lazy to True to get an iterator that yields clients as they are received instead of a list, it may be abandoned early.
+        """
+        return self.submitCommandIter("clientdblist") if lazy else self.submitCommand("clientdblist")
+
+    def iterClientDatabase(self, page_size=200, start=0, since=None):
+        """
+            Walks EVERY client in the database a page at a time using the start/duration cursor of "clientdblist", so no single request is ever huge.
+            Yields (offset, client) pairs; to resume an interrupted walk pass the last offset seen + 1 as start.
+
+            If since (a unix timestamp) is given only clients that have connected after it are yielded, allowing incremental syncs.
+            The server cannot filter on this itself, so every page is still fetched.
+        """
+
+        offset = start
+        total = None #Filled in by "-count" on the first page.
+
+        while total is None or offset < total:
+
+            command = "clientdblist start=" + str(offset) + " duration=" + str(page_size) + (" -count" if total is None else "")
+            received = 0
+
+            try:
+                for client in self.submitCommandIter(command):
+
+                    if "count" in client: #"-count" tacks the size of the database onto the first row.
+                        total = int(client.pop("count"))
+
+                    if since is None or int(client["client_lastconnected"]) > since:
+                        yield (offset + received, client)
+                    received += 1
 
-    def getAllClients(self):
-        """ Requests a list of EVERY client (incl. offline ones) from the database. """
-        return self.submitCommand("clientdblist")
+            except TS3Exception as e:
+                if int(e.error_ID) == 1281: #1281 is "database empty result set", IE. we've walked off the end.
+                    return
+                raise e
+
+            if received == 0:
+                return
+
+            offset += received
 
     def getClientServerGroups(self, clientDBID):
-        return self.submitCommand("servergroupsbyclientid cldbid=" + str(clientDBID))
+        return self.cachedCommand("servergroupsbyclientid cldbid=" + str(clientDBID))
 
     def kick(self, clientID, reason, fromServer):
 
@@ -246,6 +926,14 @@ class TS3_API:
 
         return self.submitCommand("clientkick clid=" + str(clientID) + (" reasonid=" + "5" if fromServer else "4") + " reasonmsg=" + self.encode(reason))
 
+    def kickClients(self, clientIDs, reason, fromServer):
+        """ Kick several clients with a single command. """
+
+        if len(reason) > 40:
+            raise ValueError("The reason for a kick can be no greater than 40 characters. Your message was:\"" + reason + "\" w/ " + str(len(reason)) + " characters.")
+
+        return self.submitCommand("clientkick " + "|".join("clid=" + str(x) for x in clientIDs) + " reasonid=" + ("5" if fromServer else "4") + " reasonmsg=" + self.encode(reason))
+
     def banClient(self, clientID, time=0, reason=""):
 
         if len(reason) > 40:
@@ -262,9 +950,15 @@ class TS3_API:
     def messageClient(self, clientID, message):
         self.message(clientID, 1, message);
 
+    def whoAmI(self):
+        """ Details of this ServerQuery client, IE. the channel it's in. """
+        return self.cachedCommand("whoami")
+
     def messageChannel(self, channelID, message):
 
-        if self.chid != channelID:
+        self.chid = self.whoAmI()["client_channel_id"] #We may have been moved since we last looked.
+
+        if str(self.chid) != str(channelID):
             self.moveClient(self.clid, channelID) #Need to be in the channel to message it...
             self.chid = channelID
 
@@ -286,13 +980,33 @@ class TS3_API:
         return self.submitCommand("gm msg=" + self.encode(message));
 
     def getServerGroups(self):
-        return self.submitCommand("servergrouplist")
+        return self.cachedCommand("servergrouplist")
+
+    def getServerGroup(self, serverGroupID):
+        """ Look up a server group by its ID, or None if there isn't one. """
+        groups = self.cachedIndex("servergrouplist", "sgid").get(str(serverGroupID))
+        return groups[0].copy() if groups else None
 
-    def getServerGroupMembers(self, serverGroupID):
-        return self.submitCommand("servergroupclientlist sgid=" + str(serverGroupID))
+    def getServerGroupsBySortID(self):
+        """ The server groups ordered by their "sortid", highest ranked (lowest sortid) first. """
+        groups = self.getServerGroups()
+        return sorted(groups if isinstance(groups, list) else [groups], key=lambda x: int(x["sortid"]))
+
+    def getServerGroupMembers(self, serverGroupID, lazy=False):
+        """ Request the members of a server group. Set lazy to True to get an iterator that yields members as they are received instead of a list. """
+        command = "servergroupclientlist sgid=" + str(serverGroupID)
+        return self.submitCommandIter(command) if lazy else self.cachedCommand(command)
 
     def addClientToServerGroup(self, clientDBID, serverGroupID):
         return self.submitCommand("servergroupaddclient sgid=" + str(serverGroupID) + " cldbid=" + str(clientDBID));
 
     def removeClientFromServerGroup(self, clientDBID, serverGroupID):
         return self.submitCommand("servergroupdelclient sgid=" + str(serverGroupID) + " cldbid=" + str(clientDBID));
+
+    def addClientsToServerGroup(self, clientDBIDs, serverGroupID):
+        """ Add several clients to a server group with a single command. """
+        return self.submitCommand("servergroupaddclient sgid=" + str(serverGroupID) + " " + "|".join("cldbid=" + str(x) for x in clientDBIDs))
+
+    def removeClientsFromServerGroup(self, clientDBIDs, serverGroupID):
+        """ Remove several clients from a server group with a single command. """
+        return self.submitCommand("servergroupdelclient sgid=" + str(serverGroupID) + " " + "|".join("cldbid=" + str(x) for x in clientDBIDs))
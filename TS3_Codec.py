@@ -0,0 +1,92 @@
+'''
+    A single-pass codec for the escape sequences TS3 ServerQuery uses to transmit reserved characters,
+    along with the parser for its "key=value key=value" formatted responses.
+
+'''
+import re
+
+TS3_ESCAPE = [ #Series of escape characters required to communicate successfully with TS3.
+        ("\\", r"\\"), # \
+        ("/", r"\/"),  # /
+        (" ", r"\s"),  # Space
+        ("|", r"\p"),  # |
+        ("\a", r"\a"), # Bell
+        ("\b", r"\b"), # Backspace
+        ("\f", r"\f"), # Form Feed
+        ("\n", r"\n"), # Newline
+        ("\r", r"\r"), # Carriage Return
+        ("\t", r"\t"), # Horizontal Tab
+        ("\v", r"\v")  # Vertical Tab
+]
+
+ENCODE_TABLE = dict(TS3_ESCAPE)                                                 #Normal character -> escape sequence.
+ENCODE_PATTERN = re.compile("[" + re.escape("".join(ENCODE_TABLE)) + "]")       #Any one reserved character.
+DECODE_TABLE = dict((sq_char, py_char) for (py_char, sq_char) in TS3_ESCAPE)    #Escape sequence -> normal character.
+DECODE_PATTERN = re.compile(r"\\.", re.DOTALL)                                  #Any backslash and the character following it.
+
+def _encodeMatch(match):
+    return ENCODE_TABLE[match.group()]
+
+def _decodeMatch(match):
+    seq = match.group()
+    return DECODE_TABLE.get(seq, seq) #Unknown escape sequences are left as they were.
+
+def encode(s):
+    """ Replace any/all characters reserved by TS3 for formatting transmissions/responses with their safe escape character counterparts. """
+
+    if s.isalnum(): #Letters and digits never need escaping.
+        return s
+
+    return ENCODE_PATTERN.sub(_encodeMatch, s)
+
+def decode(s):
+    """
+        Replace any/all TS3 escape sequences with their normal characters.
+        The string is scanned once from left to right, so an escaped backslash is never mistaken for the start of another escape sequence.
+    """
+
+    if "\\" not in s: #Most values (IDs, counters, timestamps...) contain no escapes at all.
+        return s
+
+    return DECODE_PATTERN.sub(_decodeMatch, s)
+
+FIELD_NAMES = {} #Field names as received -> decoded. Every row of a response has the same few, so each is decoded once and the strings shared by every row.
+
+def parseMapBytes(raw):
+    """
+        parseMap for a row as the raw bytes it was received as. Only the values are decoded, the field names come from FIELD_NAMES.
+
+        Example Input: b"clid=5 client_nickname=Tom\\sG client_away_message"
+        Example Output: {"clid" : "5", "client_nickname" : "Tom G", "client_away_message" : None}
+    """
+
+    dic = {}
+    for ele in raw.split(b" "):
+
+        (key, sep, value) = ele.partition(b"=")
+
+        name = FIELD_NAMES.get(key)
+        if name is None:
+            name = key.decode()
+            if len(FIELD_NAMES) < 4096: #There are only so many fields, don't let a misbehaving server grow this forever.
+                FIELD_NAMES[key] = name
+
+        dic[name] = decode(value.decode()) if sep else None
+
+    return dic
+
+def parseMap(raw_string):
+    """
+        Turns the formatted map-like string response of a TS3 server into a python dictionary.
+
+        Example Input: virtualserver_status=unknown virtualserver_unique_identifier virtualserver_port=0
+        Example Output: {"virtualserver_status" : "unknown", "virtualserver_unique_identifier" : None, "virtualserver_port" : "0"}
+    """
+
+    dic = {}
+    for ele in raw_string.split(" "): #Key value pairs are delimited by spaces (" ").
+
+        (key, sep, value) = ele.partition("=") #Split on the first "=" only, the value may contain more as it is not a reserved character.
+        dic[key] = decode(value) if sep else None #No "=" present means this key had no associated value and should therefore be None.
+
+    return dic
@@ -0,0 +1,175 @@
+'''
+    A pool of authenticated ServerQuery sessions.
+
+    TS3's flood protection is per connection, so K sessions may send K times as many commands as one.
+    Sessions are handed out one caller at a time through session(), while map() and submitCommands()
+    spread work across all of them at once.
+
+'''
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from Exceptions import TS3Exception
+from Metrics    import Metrics
+from TS3_API    import TS3_API
+
+class TS3_Pool(object):
+
+    #Sessions left unused for longer than this many seconds are checked with a "whoami" before being handed out.
+    health_check_interval = 60
+
+    def __init__(self, address, port, username, password, size=4, sid=1, nickname=None, whitelisted=False, flood_commands=None, flood_time=None, typed=False,
+                 keepalive_interval=TS3_API.keepalive_interval):
+
+        self.address = address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.sid = sid
+        self.nickname = nickname if nickname is not None else username
+        self.flood_settings = (whitelisted, flood_commands, flood_time)
+        self.typed = typed
+        self.keepalive_interval = keepalive_interval
+
+        self.idle = queue.Queue() #Sessions not currently handed out.
+        self.last_used = {}       #Session -> time it was last returned to the pool.
+        self.sessions = []        #Every session, handed out or not.
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """ Connect, login and select the virtual server on every session of the pool. """
+
+        for _ in range(self.size):
+            self.add()
+
+    def add(self):
+        """ Open one more session and put it in the pool, IE. to open a pool a session at a time. Returns the session. """
+
+        api = self.openSession(len(self.sessions))
+        self.sessions.append(api)
+        self.release(api)
+        return api
+
+    def close(self):
+        """ Disconnect every session. """
+
+        for api in self.sessions:
+            try:
+                api.disconnect()
+            except Exception:
+                pass #It's going away either way.
+
+        self.sessions = []
+        self.last_used = {}
+        self.idle = queue.Queue()
+
+    def metrics(self):
+        """ The Metrics of every session, totalled. """
+
+        total = Metrics()
+        for api in self.sessions:
+            total.merge(api.metrics)
+        return total
+
+    def openSession(self, index):
+
+        api = TS3_API()
+        api.typed = self.typed
+        api.keepalive_interval = self.keepalive_interval
+        api.configureFloodControl(*self.flood_settings) #First, so logging in is paced by them too.
+        api.connect(self.address, self.port, self.sid)
+        api.login(self.username, self.password, self.nickname + (" " + str(index + 1) if index > 0 else "")) #Nicknames must be unique on the server.
+
+        return api
+
+    def release(self, api):
+        self.last_used[api] = time.monotonic()
+        self.idle.put(api)
+
+    def replace(self, api):
+        """ Swap a dead session for a fresh one. """
+
+        api.stopKeepAlive()
+        api.auto_reconnect = False #Its replacement takes over, it mustn't come back to life behind our back.
+
+        try:
+            api.conn.close()
+        except (AttributeError, OSError):
+            pass
+
+        index = self.sessions.index(api)
+        fresh = self.openSession(index)
+        self.sessions[index] = fresh
+        del self.last_used[api]
+
+        return fresh
+
+    def isAlive(self, api):
+        try:
+            api.submitCommand("whoami")
+            return True
+        except (OSError, EOFError):
+            return False
+
+    @contextmanager
+    def session(self):
+        """
+            Borrow a session for the duration of a with block, blocking until one is free.
+            Sessions idle for a while are health checked first, and any session whose connection dies while borrowed is reconnected.
+        """
+
+        api = self.idle.get()
+
+        try:
+            if time.monotonic() - self.last_used[api] > self.health_check_interval and not self.isAlive(api):
+                api = self.replace(api)
+        except BaseException:
+            self.idle.put(api) #Hand it back regardless, a later checkout will try again.
+            raise
+
+        try:
+            yield api
+        except (OSError, EOFError):
+            api = self.replace(api)
+            raise
+        finally:
+            self.release(api)
+
+    def map(self, function, items):
+        """
+            Call function(session, item) for every item, spread across the pool's sessions in parallel.
+            Returns a list of the results in the order of items, holding the TS3Exception in place of the result of any call that raised one.
+        """
+
+        def call(item):
+            with self.session() as api:
+                try:
+                    return function(api, item)
+                except TS3Exception as e:
+                    return e
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(call, items))
+
+    def submitCommands(self, commands, window=64):
+        """ Splits the commands evenly across the sessions and pipelines each share (see TS3_API.submitCommands). Results come back in order. """
+
+        shares = [commands[i::self.size] for i in range(self.size)]
+        share_results = self.map(lambda api, share: api.submitCommands(share, window), shares)
+
+        results = [None] * len(commands)
+        for (i, share) in enumerate(share_results):
+            if isinstance(share, Exception):
+                raise share
+            results[i::self.size] = share
+
+        return results
@@ -0,0 +1,195 @@
+'''
+    Compact, typed records for the rows of TS3 responses; an alternative to the dictionaries of strings parseMap returns.
+
+    Each record type has a schema of the fields it knows, which are converted once when the row is parsed (ints, booleans
+    and comma separated lists) and stored in __slots__ rather than a per-row dictionary. Fields the schema doesn't know
+    are kept as strings in the record's extra dictionary, so nothing the server sent is lost.
+
+    Records can be read and written like the dictionaries they replace, IE. client["client_idle_time"], or as attributes.
+
+'''
+
+def toBool(value):
+    return value == "1"
+
+def toIntList(value):
+    return [int(x) for x in value.split(",") if x]
+
+def serverGroupsOf(client):
+    """ The IDs of the server groups a client (a dictionary or a Client) is in, as a frozenset. Empty if the field is missing, blank or None. """
+
+    groups = client.get("client_servergroups") or []
+    if isinstance(groups, str): #IDs come as a single string delimited with "," unless we're typed. Example; "1,2,3,4".
+        groups = groups.split(",")
+    return frozenset(int(x) for x in groups if x != "")
+
+class Record(object):
+
+    __slots__ = ("extra",) #Fields not in the schema, or None if there are none.
+    SCHEMA = {}            #Field -> function converting the server's string to its value.
+
+    def __init__(self, fields=()):
+        self.extra = None
+        self.update(fields)
+
+    def update(self, fields):
+        """ Set fields from a dictionary or another record, like dict.update. String values are converted by the schema, as if parsed from the server. """
+
+        for (key, value) in (fields.items() if hasattr(fields, "items") else fields):
+
+            convert = self.SCHEMA.get(key)
+
+            if convert is None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+                continue
+
+            if isinstance(value, str):
+                try:
+                    value = convert(value) if value != "" or convert is str else None
+                except ValueError: #Not what we expected, better to keep it as it came than to lose it.
+                    pass
+
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in self.SCHEMA:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.SCHEMA:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in self.SCHEMA:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + repr(self.asDict()) + ")"
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+        if key in self.SCHEMA:
+            delattr(self, key)
+        else:
+            del self.extra[key]
+            if not self.extra:
+                self.extra = None
+
+        return value
+
+    def keys(self):
+        return [key for key in self.SCHEMA if hasattr(self, key)] + (list(self.extra) if self.extra is not None else [])
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def asDict(self):
+        return dict(self.items())
+
+    def copy(self):
+        return type(self)(self)
+
+class Client(Record):
+    """ A row of "clientlist", "clientinfo" or "clientdblist", or a client notification. """
+
+    SCHEMA = {
+        "clid": int, "cid": int, "cldbid": int, "client_database_id": int, "client_type": int,
+        "client_nickname": str, "client_unique_identifier": str, "client_platform": str, "client_version": str,
+        "client_country": str, "client_description": str, "client_away_message": str, "client_lastip": str,
+        "client_idle_time": int, "connection_connected_time": int, "client_created": int, "client_lastconnected": int,
+        "client_totalconnections": int, "client_channel_group_id": int, "client_talk_power": int,
+        "client_servergroups": toIntList,
+        "client_away": toBool, "client_flag_talking": toBool, "client_input_muted": toBool, "client_output_muted": toBool,
+        "client_input_hardware": toBool, "client_output_hardware": toBool, "client_is_recording": toBool,
+        "client_is_talker": toBool, "client_is_priority_speaker": toBool, "client_is_channel_commander": toBool,
+        "ctid": int, "cfid": int, "reasonid": int #Notifications of clients moving, arriving and leaving.
+    }
+    __slots__ = tuple(SCHEMA)
+
+class Channel(Record):
+    """ A row of "channellist" or "channelinfo". """
+
+    SCHEMA = {
+        "cid": int, "pid": int, "channel_order": int, "channel_name": str, "channel_topic": str, "channel_description": str,
+        "total_clients": int, "total_clients_family": int, "channel_maxclients": int, "channel_maxfamilyclients": int,
+        "channel_needed_subscribe_power": int, "channel_needed_talk_power": int, "channel_codec": int, "channel_codec_quality": int,
+        "channel_flag_default": toBool, "channel_flag_password": toBool, "channel_flag_permanent": toBool, "channel_flag_semi_permanent": toBool
+    }
+    __slots__ = tuple(SCHEMA)
+
+class ServerGroup(Record):
+    """ A row of "servergrouplist" or "servergroupsbyclientid". """
+
+    SCHEMA = {
+        "sgid": int, "name": str, "type": int, "iconid": int, "savedb": toBool, "sortid": int, "namemode": int,
+        "n_modifyp": int, "n_member_addp": int, "n_member_removep": int, "cldbid": int
+    }
+    __slots__ = tuple(SCHEMA)
+
+class ServerInfo(Record):
+    """ The response to "serverinfo". """
+
+    SCHEMA = {
+        "virtualserver_id": int, "virtualserver_port": int, "virtualserver_name": str, "virtualserver_status": str,
+        "virtualserver_unique_identifier": str, "virtualserver_platform": str, "virtualserver_version": str,
+        "virtualserver_maxclients": int, "virtualserver_clientsonline": int, "virtualserver_queryclientsonline": int,
+        "virtualserver_channelsonline": int, "virtualserver_uptime": int, "virtualserver_reserved_slots": int,
+        "virtualserver_default_server_group": int, "virtualserver_default_channel_group": int
+    }
+    __slots__ = tuple(SCHEMA)
+
+COMMAND_RECORDS = { #The record type the rows of each command's (or notification's) response are parsed into when typed.
+        "clientlist"             : Client,
+        "clientinfo"             : Client,
+        "clientdblist"           : Client,
+        "notifycliententerview"  : Client,
+        "notifyclientleftview"   : Client,
+        "notifyclientmoved"      : Client,
+        "channellist"            : Channel,
+        "channelinfo"            : Channel,
+        "servergrouplist"        : ServerGroup,
+        "servergroupsbyclientid" : ServerGroup,
+        "serverinfo"             : ServerInfo
+}
+
+def toRecords(command, result):
+    """ Converts a parsed response (a map, a list of maps, or None) to the records of command's type, if it has one. """
+
+    record_type = COMMAND_RECORDS.get(command.split(" ", 1)[0])
+
+    if record_type is None or result is None:
+        return result
+    if isinstance(result, list):
+        return [record_type(x) for x in result]
+    return record_type(result)
@@ -0,0 +1,113 @@
+'''
+    Micro-benchmark comparing TS3_Codec against the original multi-pass str.replace codec
+    on synthetic "clientlist" and "clientdblist" payloads of realistic size.
+
+    Usage: python benchmarks/bench_codec.py [clients] [database clients]
+
+'''
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import TS3_Codec
+from TS3_Codec import TS3_ESCAPE
+
+###############################################################################
+################ The original implementation, kept for reference ##############
+###############################################################################
+
+def old_encode(s):
+    for (py_char, sq_char) in TS3_ESCAPE:
+        s = s.replace(py_char, sq_char)
+    return s
+
+def old_decode(s):
+    for (py_char, sq_char) in reversed(TS3_ESCAPE):
+        s = s.replace(sq_char, py_char)
+    return s
+
+def old_parseMap(raw_string):
+    dic = {}
+    for ele in raw_string.split(" "):
+        pos = ele.find('=')
+        if pos != -1:
+            dic[ele[:pos]] = old_decode(ele[pos+1:])
+        else:
+            dic[ele] = None
+    return dic
+
+###############################################################################
+############################## Payload generation #############################
+###############################################################################
+
+NICKNAMES = ["Tom", "xX Sniper Xx", "AC/DC fan", "pipe|dream", "tab\tbed", "Ünïcødé ☃", "back\\slash", "plain"]
+
+def randomNickname(rng):
+    return rng.choice(NICKNAMES) + " " + str(rng.randint(0, 9999))
+
+def clientlist(count, rng):
+    """ A "clientlist -uid -away -voice -times -groups -info -country" sized response. """
+    rows = []
+    for i in range(count):
+        rows.append(" ".join([
+            "clid=" + str(i + 1), "cid=" + str(rng.randint(1, 50)), "client_database_id=" + str(rng.randint(1, 100000)),
+            "client_nickname=" + TS3_Codec.encode(randomNickname(rng)), "client_type=0",
+            "client_unique_identifier=" + TS3_Codec.encode("%027x=" % rng.getrandbits(108)),
+            "client_away=0", "client_away_message", "client_flag_talking=0", "client_input_muted=0", "client_output_muted=0",
+            "client_idle_time=" + str(rng.randint(0, 10**7)), "client_created=1467590400", "client_lastconnected=1476662400",
+            "client_servergroups=" + ",".join(str(rng.randint(6, 20)) for _ in range(rng.randint(1, 3))),
+            "client_channel_group_id=8", "client_version=" + TS3_Codec.encode("3.0.19.4 [Build: 1468491418]"),
+            "client_platform=Windows", "client_country=AU",
+        ]))
+    return "|".join(rows)
+
+def clientdblist(count, rng):
+    """ A "clientdblist" sized response. """
+    rows = []
+    for i in range(count):
+        rows.append(" ".join([
+            "cldbid=" + str(i + 1), "client_unique_identifier=" + TS3_Codec.encode("%027x=" % rng.getrandbits(108)),
+            "client_nickname=" + TS3_Codec.encode(randomNickname(rng)), "client_created=1467590400",
+            "client_lastconnected=" + str(1467590400 + rng.randint(0, 10**7)), "client_totalconnections=" + str(rng.randint(1, 500)),
+            "client_description", "client_lastip=" + "10.0.%d.%d" % (rng.randint(0, 255), rng.randint(0, 255)),
+        ]))
+    return "|".join(rows)
+
+###############################################################################
+################################## Harness ####################################
+###############################################################################
+
+def bench(name, old, new, repeat=5):
+    old_time = min(timeit.repeat(old, number=1, repeat=repeat))
+    new_time = min(timeit.repeat(new, number=1, repeat=repeat))
+    print("%-28s old %9.2f ms   new %9.2f ms   x%.1f" % (name, old_time * 1000, new_time * 1000, old_time / new_time))
+
+def main():
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    rng = random.Random(0)
+    payloads = [("clientlist (%d)" % clients, clientlist(clients, rng)), ("clientdblist (%d)" % db_clients, clientdblist(db_clients, rng))]
+
+    for (name, payload) in payloads:
+
+        rows = payload.split("|")
+
+        #The new codec must round trip exactly and encode identically before its speed means anything.
+        values = [v for row in rows for v in TS3_Codec.parseMap(row).values() if v is not None]
+        assert all(TS3_Codec.decode(TS3_Codec.encode(v)) == v for v in values)
+        assert [old_encode(v) for v in values] == [TS3_Codec.encode(v) for v in values]
+
+        #The old decoder replaced "\s" before "\\", so an escaped backslash followed by "s" (etc.) came back mangled.
+        wrong = sum(old_decode(TS3_Codec.encode(v)) != v for v in values)
+
+        print("%s: %d bytes, %d values (%d mis-decoded by the old codec)" % (name, len(payload.encode()), len(values), wrong))
+        bench("  encode", lambda: [old_encode(v) for v in values], lambda: [TS3_Codec.encode(v) for v in values])
+        bench("  parse", lambda: [old_parseMap(x) for x in rows], lambda: [TS3_Codec.parseMap(x) for x in rows])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''
+    Benchmark of TS3_API's response reader on ever larger responses, to show its cost per byte stays flat.
+
+    A local server answers "clientdblist" and "permissionlist" with canned synthetic responses of each size, and the time
+    submitCommand takes to read and parse them is reported per byte. For comparison, the same responses are read as
+    TS3_API used to, with telnetlib (which reads 50 bytes at a time and filters every byte for telnet commands in Python)
+    and string level parsing. telnetlib is gone from Python 3.13 on, where that column is left out.
+    telnetlib's reads take time quadratic in the size of the response, so it is only run up to TELNETLIB_MAX_ROWS rows.
+
+    Usage: python benchmarks/bench_reader.py [rows,rows,...]
+
+'''
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import telnetlib
+except ImportError:
+    telnetlib = None
+
+from TS3_API     import TS3_API
+from TS3_Codec   import encode, parseMap
+from bench_codec import clientdblist
+
+DEFAULT_SIZES = [1000, 4000, 16000]
+TELNETLIB_MAX_ROWS = 16000 #Beyond this the telnetlib column takes minutes.
+
+PERMISSIONS = ["b_serverinstance_help_view", "b_virtualserver_info_view", "i_client_kick_from_server_power", "b_client_ignore_antiflood",
+               "i_channel_needed_join_power", "b_virtualserver_channel_create", "i_client_talk_power", "b_client_use_channel_commander"]
+
+def permissionlist(count, rng):
+    """ A "permissionlist" sized response; a real server's has around 400 of these rows. """
+    return "|".join(" ".join([
+        "permid=" + str(i + 1), "permname=" + rng.choice(PERMISSIONS) + "_" + str(i),
+        "permdesc=" + encode("Allows the client to do something quite specific, number " + str(i) + ".")
+    ]) for i in range(count))
+
+def serve(payloads):
+    """ Listen on a free port, answering commands with payloads[verb] (or just an OK) forever. Returns the port. """
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def handle(conn):
+        conn.sendall(b"TS3\n\rWelcome to the TeamSpeak 3 ServerQuery interface.\n\r")
+        with conn.makefile("rb") as lines:
+            for line in lines:
+                payload = payloads.get(line.strip().split(b" ")[0])
+                conn.sendall((payload + b"\n\r" if payload is not None else b"") + b"error id=0 msg=ok\n\r")
+
+    def accept():
+        while True:
+            threading.Thread(target=handle, args=(listener.accept()[0],), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+def readWithTelnetlib(port, verb):
+    """ The old reader: telnetlib's read_until, then decoding, stripping and splitting the response as strings. """
+
+    conn = telnetlib.Telnet("127.0.0.1", port)
+    conn.read_until(b"\n\r")
+    conn.read_until(b"\n\r")
+    try:
+        started = time.perf_counter()
+        conn.write(verb + b"\n\r")
+        rows = [parseMap(x) for x in conn.read_until(b"\n\r").decode().strip().split("|")]
+        conn.read_until(b"\n\r")
+        return (time.perf_counter() - started, len(rows))
+    finally:
+        conn.close()
+
+def best(function, repeat=3):
+    return min(function() for _ in range(repeat))
+
+def main():
+
+    sizes = [int(x) for x in sys.argv[1].split(",")] if len(sys.argv) > 1 else DEFAULT_SIZES
+
+    rng = random.Random(0)
+    payloads = {}
+    for rows in sizes:
+        payloads[b"clientdblist" + str(rows).encode()] = clientdblist(rows, rng).encode()
+        payloads[b"permissionlist" + str(rows).encode()] = permissionlist(rows, rng).encode()
+
+    port = serve(payloads)
+
+    api = TS3_API()
+    api.keepalive_interval = None
+    api.configureFloodControl(whitelisted=True)
+    api.connect("127.0.0.1", port)
+
+    def timeAPI(verb):
+        started = time.perf_counter()
+        assert len(api.submitCommand(verb)) > 0
+        return time.perf_counter() - started
+
+    print("%-22s %10s %12s %10s %14s %10s" % ("response", "bytes", "TS3_API", "ns/byte", "telnetlib", "ns/byte"))
+
+    for verb in ("clientdblist", "permissionlist"):
+        for rows in sizes:
+            name = verb + str(rows)
+            size = len(payloads[name.encode()])
+
+            seconds = best(lambda: timeAPI(name))
+            line = "%-22s %10d %10.1fms %10.1f" % (verb + " (" + str(rows) + ")", size, seconds * 1000, seconds * 1e9 / size)
+
+            if telnetlib is not None and rows <= TELNETLIB_MAX_ROWS:
+                old_seconds = best(lambda: readWithTelnetlib(port, name.encode())[0], repeat=1)
+                line += " %12.1fms %10.1f" % (old_seconds * 1000, old_seconds * 1e9 / size)
+            elif telnetlib is not None:
+                line += " %14s %10s" % ("-", "-")
+
+            print(line)
+
+    api.disconnect()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+    Micro-benchmark comparing the dictionaries of strings parseMap returns against typed TS3_Records,
+    on the same synthetic "clientlist" and "clientdblist" payloads as bench_codec.
+
+    Measures the memory the parsed rows hold and the time spent by a kickIdlers style loop over them.
+
+    Usage: python benchmarks/bench_records.py [clients] [database clients]
+
+'''
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from TS3_Codec   import parseMap
+from TS3_Records import Client
+from bench_codec import clientlist, clientdblist
+
+def measure(parse, rows):
+    """ Returns the bytes held by the parsed rows, along with the rows themselves. """
+
+    tracemalloc.start()
+    parsed = [parse(row) for row in rows]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (held, parsed)
+
+def idleLoop(clients):
+    """ The number crunching kickIdlers does for every client, three times over as a daemon doing a few runs would. """
+    for _ in range(3):
+        for client in clients:
+            int(client["client_idle_time"]) >= 600_000
+            [int(x) for x in client["client_servergroups"].split(",")]
+
+def typedIdleLoop(clients):
+    for _ in range(3):
+        for client in clients:
+            client["client_idle_time"] >= 600_000
+            client["client_servergroups"]
+
+def main():
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    rng = random.Random(0)
+    payloads = [("clientlist (%d)" % clients, clientlist(clients, rng)), ("clientdblist (%d)" % db_clients, clientdblist(db_clients, rng))]
+
+    for (name, payload) in payloads:
+
+        rows = payload.split("|")
+
+        (dict_bytes, dicts) = measure(parseMap, rows)
+        (record_bytes, records) = measure(lambda row: Client(parseMap(row)), rows)
+
+        #Records must hold the same information, only typed.
+        assert all(sorted(d) == sorted(r.keys()) for (d, r) in zip(dicts, records))
+
+        print("%s: dicts hold %.1f KiB, records %.1f KiB (x%.1f)" % (name, dict_bytes / 1024, record_bytes / 1024, dict_bytes / record_bytes))
+
+        parse_dicts = min(timeit.repeat(lambda: [parseMap(x) for x in rows], number=1, repeat=5))
+        parse_records = min(timeit.repeat(lambda: [Client(parseMap(x)) for x in rows], number=1, repeat=5))
+        print("  parse                      dicts %9.2f ms   records %9.2f ms" % (parse_dicts * 1000, parse_records * 1000))
+
+        if "client_servergroups" in dicts[0]:
+            loop_dicts = min(timeit.repeat(lambda: idleLoop(dicts), number=1, repeat=5))
+            loop_records = min(timeit.repeat(lambda: typedIdleLoop(records), number=1, repeat=5))
+            print("  policy loop                dicts %9.2f ms   records %9.2f ms   x%.1f" % (loop_dicts * 1000, loop_records * 1000, loop_dicts / loop_records))
+
+if __name__ == '__main__':
+    main()
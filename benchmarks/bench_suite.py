@@ -0,0 +1,173 @@
+'''
+    End to end benchmarks of TS3_API against the fake ServerQuery server, at several server sizes.
+
+    For each size it times:
+        parse       Parsing a "clientlist" response, as dictionaries and as typed records.
+        round trip  Sequential "whoami"s, and the same number pipelined.
+        sweep       getConnectedClients(detailed=True), IE. a "clientinfo" for every client.
+        policies    Main's kickIdlers and manageUsersGroups over the sweep's clients.
+        run         A run of Main on a fresh server: a flagged clientlist and the policies, which fetch what it lacks as they need it.
+
+    Results are printed and written as JSON (to benchmarks/results/<commit>.json unless --out is given).
+    Pass --compare with an earlier results file to see how this commit fares against it.
+
+    Usage: python benchmarks/bench_suite.py [--sizes 10,100,1000,10000] [--latency ms] [--flood commands/seconds] [--out file] [--compare file]
+
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import Main
+from Logger      import Logger
+from TS3_API     import TS3_API
+from TS3_Codec   import parseMap
+from TS3_Records import Client
+from fake_server import FakeServer, VirtualServer, formatRows
+
+ROUND_TRIPS = 200
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return (time.perf_counter() - started, result)
+
+def best(function, repeat=3):
+    return min(timed(function)[0] for _ in range(repeat))
+
+def connect(server, typed):
+    api = TS3_API()
+    api.keepalive_interval = None #Nothing we do is slow enough to need one.
+    api.typed = typed
+    if server.flood_commands is None:
+        api.configureFloodControl(whitelisted=True)
+    else:
+        api.configureFloodControl(commands=server.flood_commands, period=server.flood_time)
+    api.connect("127.0.0.1", server.port)
+    api.login("serveradmin", "password")
+    return api
+
+def benchSize(clients, latency, flood):
+
+    results = {}
+    state = VirtualServer(clients)
+
+    #Parsing alone, no sockets involved.
+    rows = formatRows([state.clientRow(client) for client in state.online.values()]).split("|")
+    results["parse_dicts"] = best(lambda: [parseMap(row) for row in rows])
+    results["parse_records"] = best(lambda: [Client(parseMap(row)) for row in rows])
+
+    flood_commands, flood_time = flood if flood else (None, 3)
+
+    with FakeServer(state, latency, flood_commands, flood_time) as server:
+
+        api = connect(server, typed=True)
+
+        results["round_trips_sequential"] = timed(lambda: [api.submitCommand("whoami") for _ in range(ROUND_TRIPS)])[0]
+        results["round_trips_pipelined"] = timed(lambda: api.submitCommands(["whoami"] * ROUND_TRIPS))[0]
+
+        (results["sweep"], connected_clients) = timed(lambda: api.getConnectedClients(detailed=True))
+
+        #Main's policies, as a run of Main would use them; logging to a throwaway directory.
+        with tempfile.TemporaryDirectory() as log_dir:
+            (Main.API, Main.POOL, Main.DRY_RUN) = (api, None, False)
+            Main.LOGGER = Logger(log_dir, echo=False)
+
+            server_info = api.getServerInfo()
+            results["policies"] = timed(lambda: (Main.kickIdlers(server_info, connected_clients), Main.manageUsersGroups(server_info, connected_clients)))[0]
+
+            Main.LOGGER.close()
+
+        results["commands_sent"] = sum(api.metrics.commands.values())
+        results["flood_wait"] = api.metrics.flood_wait_time
+        api.disconnect()
+
+    with FakeServer(VirtualServer(clients), latency, flood_commands, flood_time) as server:
+
+        api = connect(server, typed=True)
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            (Main.API, Main.POOL, Main.DRY_RUN) = (api, None, False)
+            Main.LOGGER = Logger(log_dir, echo=False)
+            server_info = api.getServerInfo()
+            sent = sum(api.metrics.commands.values())
+
+            def run():
+                connected_clients = api.getConnectedClients(fields=Main.CLIENT_FIELDS)
+                Main.kickIdlers(server_info, connected_clients)
+                Main.manageUsersGroups(server_info, connected_clients)
+
+            results["run"] = timed(run)[0]
+            results["run_commands"] = sum(api.metrics.commands.values()) - sent
+
+            Main.LOGGER.close()
+
+        api.disconnect()
+
+    return results
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(old, new):
+    """ Print new's timings as a ratio of old's. """
+
+    print()
+    print("Against " + old["commit"] + " (below 1.00 is faster):")
+    for (size, results) in new["results"].items():
+        if size not in old["results"]:
+            continue
+        ratios = ["%s %.2f" % (name, value / old["results"][size][name]) for (name, value) in results.items()
+                  if isinstance(value, float) and old["results"][size].get(name)]
+        print("  %6s clients: %s" % (size, ", ".join(ratios)))
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark TS3_API against a fake ServerQuery server.")
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="Comma separated numbers of connected clients.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Simulated latency of each response in milliseconds.")
+    parser.add_argument("--flood", default=None, help="Simulated flood limit as commands/seconds, IE. 10/3. Unlimited by default.")
+    parser.add_argument("--out", default=None, help="Where to write the results.")
+    parser.add_argument("--compare", default=None, help="Earlier results to compare against.")
+    args = parser.parse_args()
+
+    flood = tuple(int(x) for x in args.flood.split("/")) if args.flood else None
+    commit = gitCommit()
+
+    report = {
+        "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+        "latency_ms": args.latency, "flood": args.flood, "results": {}
+    }
+
+    print("%8s %10s %10s %10s %10s %10s %10s %10s %9s %9s" % ("clients", "parse", "typed", "rtt seq", "rtt pipe", "sweep", "policies", "run", "commands", "run cmds"))
+
+    for size in [int(x) for x in args.sizes.split(",")]:
+        results = benchSize(size, args.latency / 1000.0, flood)
+        report["results"][str(size)] = results
+        print("%8d %8.2fms %8.2fms %8.2fms %8.2fms %8.2fms %8.2fms %8.2fms %9d %9d" % (size, results["parse_dicts"] * 1000, results["parse_records"] * 1000,
+              results["round_trips_sequential"] * 1000, results["round_trips_pipelined"] * 1000, results["sweep"] * 1000, results["policies"] * 1000,
+              results["run"] * 1000, results["commands_sent"], results["run_commands"]))
+
+    out = args.out or os.path.join(HERE, "results", commit + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    print("Results written to " + out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
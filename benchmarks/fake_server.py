@@ -0,0 +1,460 @@
+'''
+    A fake TS3 ServerQuery server for benchmarks, so TS3_API can be measured without a real (let alone production) server.
+
+    It speaks enough of the protocol for the bot: the banner, "use", "serverlist", "login", "clientupdate", "whoami", "serverinfo",
+    "clientlist", "clientinfo", "clientdblist", "channellist", the server group commands, "clientkick" and notification registration.
+    Each virtual server is synthetic, generated from a seed with however many clients, groups and channels are asked for.
+
+    Latency is simulated by holding each response back before it's written (without holding up the commands behind it,
+    so pipelining pays off as it would over a real network), and flood limits by rejecting commands over the limit with error 524.
+
+    Usage: python benchmarks/fake_server.py [port] [clients]
+
+'''
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from TS3_API   import CLIENTLIST_FLAGS
+from TS3_Codec import encode, parseMap
+
+BANNER = b"TS3\n\rWelcome to the TeamSpeak 3 ServerQuery interface, type \"help\" for a list of commands and \"help <command>\" for information on a specific command.\n\r"
+OK = "error id=0 msg=ok"
+
+PLATFORMS = ["Windows", "Windows", "Windows", "Linux", "OS X", "Android", "iOS"]
+
+def error(error_ID, message, extra_msg=None):
+    return "error id=" + str(error_ID) + " msg=" + encode(message) + (" extra_msg=" + encode(extra_msg) if extra_msg else "")
+
+class QueryError(Exception):
+    """ Raised by a command handler to answer with an error line rather than data. """
+
+def formatRow(row):
+    return " ".join(key if value is None else key + "=" + encode(str(value)) for (key, value) in row.items())
+
+def formatRows(rows):
+    return "|".join(formatRow(row) for row in rows)
+
+class VirtualServer(object):
+    """ The synthetic state of a virtual server: its channels, server groups, client database and connected clients. """
+
+    DEFAULT_GROUP = 8
+
+    sid = 1 #Given out by FakeServer when it serves several.
+
+    def __init__(self, clients=100, groups=10, channels=20, database=None, seed=0):
+
+        rng = random.Random(seed)
+        now = int(time.time())
+
+        self.channels = [{
+            "cid": cid, "pid": 0 if cid <= max(channels // 4, 1) else rng.randint(1, max(channels // 4, 1)), "channel_order": cid - 1,
+            "channel_name": "Channel " + str(cid), "total_clients": 0, "channel_needed_subscribe_power": 0
+        } for cid in range(1, channels + 1)]
+
+        #Query groups and templates first as on a real server, then the regular groups; the default among them.
+        self.groups = [
+            {"sgid": 1, "name": "Guest Server Query", "type": 2, "iconid": 0, "savedb": 0, "sortid": 0, "namemode": 0},
+            {"sgid": 2, "name": "Admin Server Query", "type": 2, "iconid": 500, "savedb": 1, "sortid": 0, "namemode": 0},
+        ]
+        for i in range(groups):
+            sgid = 6 + i
+            self.groups.append({"sgid": sgid, "name": "Group " + str(sgid) if sgid != self.DEFAULT_GROUP else "Guest", "type": 1,
+                                "iconid": 0, "savedb": 1, "sortid": (i + 1) * 5 if sgid != self.DEFAULT_GROUP else 1000, "namemode": 0})
+        regular = [group["sgid"] for group in self.groups if group["type"] == 1]
+
+        self.database = {} #cldbid -> client's database entry.
+        for cldbid in range(1, (database or clients * 4) + 1):
+            created = now - rng.randint(86400, 86400 * 1000)
+            self.database[cldbid] = {
+                "cldbid": cldbid, "client_unique_identifier": "%027x=" % rng.getrandbits(108), "client_nickname": "Client " + str(cldbid),
+                "client_created": created, "client_lastconnected": rng.randint(created, now), "client_totalconnections": rng.randint(1, 500),
+                "client_description": None, "client_lastip": "10.0.%d.%d" % (rng.randint(0, 255), rng.randint(0, 255)),
+                "groups": sorted(set(rng.choice(regular) for _ in range(rng.choice([1, 1, 1, 2, 3])))) if regular else []
+            }
+
+        self.online = {} #clid -> connected client.
+        self.next_clid = 1
+        for cldbid in rng.sample(sorted(self.database), min(clients, len(self.database))):
+            entry = self.database[cldbid]
+            connected = rng.randint(60, 86400) * 1000
+            self.addClient({
+                "cid": rng.choice(self.channels)["cid"] if self.channels else 1, "client_database_id": cldbid,
+                "client_nickname": entry["client_nickname"], "client_type": 0, "client_unique_identifier": entry["client_unique_identifier"],
+                "client_away": rng.choice([0, 0, 0, 1]), "client_away_message": None, "client_input_muted": rng.choice([0, 1]), "client_output_muted": 0,
+                "client_idle_time": rng.randint(0, connected), "client_platform": rng.choice(PLATFORMS), "client_version": "3.5.6 [Build: 1606312422]",
+                "client_country": "AU", "connection_connected_time": connected
+            })
+
+    def addClient(self, client):
+        client["clid"] = self.next_clid
+        self.online[self.next_clid] = client
+        self.next_clid += 1
+        return client
+
+    def clientRow(self, client, detailed=False, options=None):
+        """ client's row of "clientinfo" if detailed, otherwise of "clientlist" with options (its flags, every one if None). """
+
+        entry = self.database.get(client["client_database_id"])
+        row = dict(client)
+        if entry is not None:
+            row["client_servergroups"] = ",".join(str(x) for x in entry["groups"]) or str(self.DEFAULT_GROUP)
+            row.update((key, entry[key]) for key in ("client_created", "client_lastconnected", "client_totalconnections"))
+        else: #A query client.
+            row["client_servergroups"] = "2"
+
+        if detailed:
+            return row
+
+        listed = set(["clid", "cid", "client_database_id", "client_nickname", "client_type"])
+        for (flag, fields) in CLIENTLIST_FLAGS.items():
+            if options is None or flag in options:
+                listed.update(fields)
+        return dict((key, value) for (key, value) in row.items() if key in listed)
+
+    def serverInfo(self):
+        return {
+            "virtualserver_id": self.sid, "virtualserver_port": 9986 + self.sid, "virtualserver_name": "Fake Server " + str(self.sid), "virtualserver_status": "online",
+            "virtualserver_maxclients": max(len(self.online) + 8, 32), "virtualserver_clientsonline": len(self.online),
+            "virtualserver_channelsonline": len(self.channels), "virtualserver_uptime": 86400,
+            "virtualserver_default_server_group": self.DEFAULT_GROUP, "virtualserver_default_channel_group": 8
+        }
+
+class Session(object):
+    """ One ServerQuery connection. """
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.state = None     #The virtual server selected with "use", none to begin with as on a real instance.
+        self.logged_in = False
+        self.client = None    #Our own entry in the selected server's client list, once logged in.
+        self.sent = deque()   #When recent commands arrived, for the flood limit.
+        self.outbox = asyncio.Queue()
+
+    async def run(self):
+
+        deliverer = asyncio.create_task(self.deliver())
+        self.outbox.put_nowait((0, BANNER))
+
+        try:
+            buffer = b""
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                buffer += data
+
+                while b"\n" in buffer:
+                    (line, _, buffer) = buffer.partition(b"\n")
+                    command = line.strip(b"\r").decode()
+                    if not command:
+                        continue
+
+                    response = self.respond(command)
+                    self.outbox.put_nowait((time.monotonic() + self.server.latency, (response + "\n\r").encode()))
+                    if command == "quit":
+                        await self.outbox.join()
+                        return
+        finally:
+            if self.client is not None and self.state is not None:
+                self.state.online.pop(self.client["clid"], None)
+            deliverer.cancel()
+            self.writer.close()
+
+    async def deliver(self):
+        """ Writes responses out once their simulated latency has passed, in order. """
+
+        while True:
+            (when, data) = await self.outbox.get()
+            delay = when - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.writer.write(data)
+            await self.writer.drain()
+            self.outbox.task_done()
+
+    def flooding(self):
+        if self.server.flood_commands is None:
+            return False
+
+        now = time.monotonic()
+        while self.sent and self.sent[0] < now - self.server.flood_time:
+            self.sent.popleft()
+
+        if len(self.sent) >= self.server.flood_commands:
+            return True
+        self.sent.append(now)
+        return False
+
+    def respond(self, command):
+        """ The full response (data line(s) and error line) to command. """
+
+        (verb, _, rest) = command.partition(" ")
+
+        if self.flooding():
+            return error(524, "client is flooding", "please wait " + str(int(self.server.flood_time)) + " seconds")
+
+        #Options ("-uid") and pipe separated repeats ("cldbid=1|cldbid=2") are pulled out of the arguments.
+        options = [x for x in rest.split(" ") if x.startswith("-")]
+        rows = [parseMap(x.strip()) for x in " ".join(x for x in rest.split(" ") if not x.startswith("-")).split("|")] if rest.strip(" -") else [{}]
+        args = dict(rows[0])
+        for row in rows[1:]:
+            for (key, value) in row.items():
+                args.setdefault(key, value)
+
+        handler = getattr(self, "do_" + verb, None)
+        if handler is None:
+            return error(256, "command not found")
+        if self.state is None and verb not in self.INSTANCE_COMMANDS:
+            return error(1024, "invalid serverID")
+
+        try:
+            data = handler(args, rows, options)
+        except KeyError:
+            return error(1538, "invalid parameter")
+        except QueryError as e:
+            return str(e)
+
+        return (data + "\n\r" + OK) if data is not None else OK
+
+    ######################### Commands #########################
+
+    #What works before a virtual server has been selected with "use".
+    INSTANCE_COMMANDS = ("use", "login", "logout", "quit", "version", "whoami", "instanceinfo", "serverlist")
+
+    def do_use(self, args, rows, options):
+        state = self.server.servers.get(int(args["sid"]))
+        if state is None:
+            raise QueryError(error(1024, "invalid serverID"))
+        if self.client is not None: #We move over with the selection.
+            self.state.online.pop(self.client["clid"], None)
+        self.state = state
+        if self.logged_in:
+            self.join()
+        if self.client is not None and "client_nickname" in args:
+            self.client["client_nickname"] = args["client_nickname"]
+        return None
+
+    def do_login(self, args, rows, options):
+        self.logged_in = True
+        if self.state is not None:
+            self.join()
+        return None
+
+    def join(self):
+        """ Appear in the selected server's client list, as a logged in query client does. """
+
+        self.client = self.state.addClient(self.client or {"cid": 1, "client_database_id": 0, "client_nickname": "serveradmin", "client_type": 1,
+                                                           "client_platform": "ServerQuery", "client_idle_time": 0, "connection_connected_time": 0})
+
+    def do_logout(self, args, rows, options):
+        return None
+
+    def do_quit(self, args, rows, options):
+        return None
+
+    def do_version(self, args, rows, options):
+        return formatRow({"version": "3.13.7", "build": 1655727713, "platform": "Linux"})
+
+    def do_whoami(self, args, rows, options):
+        client = self.client or {"clid": 0, "cid": 0}
+        return formatRow({"virtualserver_status": "online" if self.state is not None else "unknown", "virtualserver_id": self.state.sid if self.state is not None else 0, "client_id": client["clid"], "client_channel_id": client["cid"],
+                          "client_nickname": client.get("client_nickname", "Unknown"), "client_database_id": 1, "client_login_name": "serveradmin"})
+
+    def do_clientupdate(self, args, rows, options):
+        if self.client is not None and "client_nickname" in args:
+            self.client["client_nickname"] = args["client_nickname"]
+        return None
+
+    def do_servernotifyregister(self, args, rows, options):
+        return None
+
+    def do_servernotifyunregister(self, args, rows, options):
+        return None
+
+    def do_instanceinfo(self, args, rows, options):
+        return formatRow({"serverinstance_serverquery_flood_commands": self.server.flood_commands or 10,
+                          "serverinstance_serverquery_flood_time": int(self.server.flood_time)})
+
+    def do_serverlist(self, args, rows, options):
+        return formatRows([dict((key, value) for (key, value) in state.serverInfo().items() if not key.startswith("virtualserver_default"))
+                           for state in self.server.servers.values()])
+
+    def do_serverinfo(self, args, rows, options):
+        return formatRow(self.state.serverInfo())
+
+    def do_channellist(self, args, rows, options):
+        return formatRows(self.state.channels)
+
+    def do_clientlist(self, args, rows, options):
+        state = self.state
+        return formatRows([state.clientRow(client, options=options) for client in state.online.values()])
+
+    def do_clientinfo(self, args, rows, options):
+        client = self.state.online.get(int(args["clid"]))
+        if client is None:
+            raise QueryError(error(512, "invalid clientID"))
+        row = self.state.clientRow(client, detailed=True)
+        del row["clid"]
+        return formatRow(row)
+
+    def do_clientdblist(self, args, rows, options):
+        database = self.state.database
+        start = int(args.get("start") or 0)
+        duration = int(args.get("duration") or 25)
+        page = [dict((key, value) for (key, value) in entry.items() if key != "groups") for entry in list(database.values())[start:start + duration]]
+        if not page:
+            raise QueryError(error(1281, "database empty result set"))
+        if "-count" in options:
+            page[0]["count"] = len(database)
+        return formatRows(page)
+
+    def do_clientkick(self, args, rows, options):
+        online = self.state.online
+        clids = [int(row["clid"]) for row in rows]
+        if any(clid not in online for clid in clids):
+            raise QueryError(error(512, "invalid clientID"))
+        for clid in clids:
+            del online[clid]
+        return None
+
+    def do_clientmove(self, args, rows, options):
+        for row in rows:
+            client = self.state.online.get(int(row["clid"]))
+            if client is None:
+                raise QueryError(error(512, "invalid clientID"))
+            client["cid"] = int(args["cid"])
+        return None
+
+    def do_sendtextmessage(self, args, rows, options):
+        return None
+
+    def do_servergrouplist(self, args, rows, options):
+        return formatRows(self.state.groups)
+
+    def do_servergroupsbyclientid(self, args, rows, options):
+        state = self.state
+        entry = state.database.get(int(args["cldbid"]))
+        if entry is None:
+            raise QueryError(error(1281, "database empty result set"))
+        groups = dict((group["sgid"], group) for group in state.groups)
+        return formatRows([{"name": groups[sgid]["name"], "sgid": sgid, "cldbid": entry["cldbid"]} for sgid in entry["groups"] or [state.DEFAULT_GROUP]])
+
+    def do_servergroupclientlist(self, args, rows, options):
+        sgid = int(args["sgid"])
+        return formatRows([{"cldbid": cldbid} for (cldbid, entry) in self.state.database.items() if sgid in entry["groups"]]) or None
+
+    def do_servergroupaddclient(self, args, rows, options):
+        database = self.state.database
+        sgid = int(args["sgid"])
+        for row in rows:
+            entry = database.get(int(row["cldbid"]))
+            if entry is None:
+                raise QueryError(error(1281, "database empty result set"))
+            if sgid in entry["groups"]:
+                raise QueryError(error(2561, "duplicate entry"))
+            entry["groups"] = sorted(entry["groups"] + [sgid])
+        return None
+
+    def do_servergroupdelclient(self, args, rows, options):
+        database = self.state.database
+        sgid = int(args["sgid"])
+        for row in rows:
+            entry = database.get(int(row["cldbid"]))
+            if entry is None or sgid not in entry["groups"]:
+                raise QueryError(error(1281, "database empty result set"))
+            entry["groups"].remove(sgid)
+        return None
+
+class FakeServer(object):
+    """
+        Serves a VirtualServer (or a list of them, as virtual servers 1, 2..., or a dictionary of them by virtual server ID) on localhost from a background thread, so synchronous code like TS3_API can talk to it.
+        latency is the seconds each response is held back for; with flood_commands set, more than that many commands
+        in flood_time seconds are rejected as they would be by a real server.
+    """
+
+    def __init__(self, state=None, latency=0.0, flood_commands=None, flood_time=3):
+        if isinstance(state, dict):
+            states = sorted(state.items())
+        else:
+            states = list(enumerate(state if isinstance(state, list) else [state if state is not None else VirtualServer()], 1))
+        self.servers = {} #sid -> VirtualServer.
+        for (sid, virtual_server) in states:
+            virtual_server.sid = sid
+            self.servers[sid] = virtual_server
+        self.state = states[0][1]
+        self.latency = latency
+        self.flood_commands = flood_commands
+        self.flood_time = flood_time
+
+        self.port = None
+        self.sessions = set()
+        self.loop = None
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self, port=0):
+        """ Start serving in the background. Returns the port, which is chosen by the OS unless one is given. """
+
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", port, limit=2**26))
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            server.close()
+            for session in list(self.sessions): #Connections still open, their clients never quit.
+                session.writer.close()
+            pending = asyncio.all_tasks(self.loop)
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.run_until_complete(server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, name="FakeServer", daemon=True)
+        self.thread.start()
+        started.wait()
+
+        return self.port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def handle(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+
+if __name__ == '__main__':
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 10011
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    server = FakeServer(VirtualServer(clients))
+    server.start(port)
+    print("Fake ServerQuery server with " + str(clients) + " clients listening on 127.0.0.1:" + str(server.port) + ". Ctrl+C to stop.")
+
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
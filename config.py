@@ -3,3 +3,47 @@ PASSWORD = ""
 
 PORT = 10011    #Default port.
 DOMAIN = ""
+
+#Flood protection. If this machine's IP is in the server's query_ip_whitelist.txt it is exempt and can run at full speed.
+FLOOD_WHITELISTED = False
+FLOOD_COMMANDS = None   #Commands allowed every FLOOD_TIME seconds. Leave as None to use the server's own limits.
+FLOOD_TIME = None
+
+#Number of ServerQuery sessions to open. Each has its own flood allowance, so per-client commands are spread across them all.
+POOL_SIZE = 1
+
+#Instances whose virtual servers are all managed from one process when started with --all-servers, see Orchestrator.
+#Each needs an "address", and may set "port", "username", "password", "nickname", "servers" (virtual server IDs, None for every online one),
+#"sessions" (logins working through its servers at once) and the flood settings "whitelisted", "flood_commands" and "flood_time".
+#Left empty, every virtual server of DOMAIN's instance is managed with the settings above.
+INSTANCES = [
+    #{"address": "ts.example.com", "port": 10011, "username": "serveradmin", "password": "", "servers": None, "sessions": 2},
+]
+
+#Seconds between policy runs when started with --daemon.
+DAEMON_INTERVAL = 300
+
+#Seconds of inactivity after which a keep-alive is sent, the server drops ServerQuery connections idle for 10 minutes. None to disable.
+KEEPALIVE_INTERVAL = 240
+
+#Who kickIdlers kicks; a client matching any rule is kicked unless they match an exemption. See KickPolicy.KickRule for the conditions available.
+#Thresholds given as (base, per empty slot) are more lenient the emptier the server is. Times are in milliseconds.
+KICK_RULES = [
+    {"name": "Idle too long", "reason": "Idle for too long.", "min_idle_time": (600_000, 5 * 60 * 1000)},          #10 minutes + 5 per empty slot.
+    {"name": "Idle too often", "reason": "Idle for most of your time connected.", "min_idle_percent": (76, 1)},  #More than 75% + 1% per empty slot.
+]
+KICK_EXEMPTIONS = [
+    {"platforms": ["ServerQuery"]}, #That's us!
+]
+KICK_LIMIT = None #Most clients kicked in one run, the most idle first. None for no limit.
+
+#File the command metrics (counts, errors, bytes, latencies, flood control waits) are written to at the end of a run. See Metrics.
+#A name ending in ".json" gets a JSON snapshot, anything else Prometheus' text format (IE. for node_exporter's textfile collector). None to skip.
+METRICS_FILE = None
+
+#SQLite database each run records the connected clients and the server's occupancy in, for looking back over past runs. See ClientHistory. None to not keep one.
+HISTORY_FILE = None
+HISTORY_DAYS = 90 #Days of runs kept.
+
+#Write the logs as one JSON object per line (to logs/<date>.jsonl) rather than plain text.
+LOG_JSON = False
@@ -0,0 +1,135 @@
+'''
+    TS3_API against the fake ServerQuery server from benchmarks: pipelining, matching errors to their commands,
+    abandoning a streamed response, walking the client database a page at a time and reconnecting after a dropped connection.
+
+    Usage: python -m pytest -q tests
+
+'''
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+
+from Exceptions  import TS3Exception
+from TS3_API     import TS3_API
+from fake_server import FakeServer, VirtualServer
+
+@pytest.fixture
+def server():
+    with FakeServer(VirtualServer(clients=10, database=53)) as server:
+        yield server
+
+@pytest.fixture
+def api(server):
+    api = TS3_API()
+    api.keepalive_interval = None
+    api.configureFloodControl(whitelisted=True)
+    api.connect("127.0.0.1", server.port)
+    api.login("serveradmin", "password")
+    yield api
+    try:
+        api.disconnect()
+    except OSError: #Left dropped by the test.
+        pass
+
+def dropConnections(server):
+    """ Abort every open session from the server's side, as a crashed or restarted server would, and wait until they're gone. """
+
+    for session in list(server.sessions):
+        server.loop.call_soon_threadsafe(session.writer.transport.abort)
+
+    deadline = time.monotonic() + 5
+    while server.sessions and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not server.sessions
+
+def test_pipelined_responses_match_their_commands(server, api):
+    clids = sorted(clid for (clid, client) in server.state.online.items() if client["client_type"] == 0)
+
+    results = api.submitCommands(["clientinfo clid=" + str(clid) for clid in clids] + ["whoami"], window=4)
+
+    assert len(results) == len(clids) + 1
+    for (clid, result) in zip(clids, results):
+        assert result["client_nickname"] == server.state.online[clid]["client_nickname"]
+    assert results[-1]["virtualserver_id"] == "1"
+
+def test_errors_are_matched_to_their_commands(server, api):
+    clid = next(iter(server.state.online))
+
+    results = api.submitCommands(["clientinfo clid=" + str(clid), "clientinfo clid=99999", "whoami", "clientinfo clid=99998"])
+
+    assert results[0]["client_nickname"] == server.state.online[clid]["client_nickname"]
+    assert isinstance(results[1], TS3Exception) and int(results[1].error_ID) == 512
+    assert results[2]["client_login_name"] == "serveradmin"
+    assert isinstance(results[3], TS3Exception) and int(results[3].error_ID) == 512
+
+    #The connection is still in step afterwards.
+    assert api.submitCommand("whoami")["client_login_name"] == "serveradmin"
+
+def test_abandoned_stream_is_discarded(server, api):
+    rows = api.submitCommandIter("clientdblist start=0 duration=50")
+    assert next(rows)["cldbid"] == "1"
+    assert next(rows)["cldbid"] == "2"
+
+    #The rest of the response is drained before the next command reads its own.
+    assert api.submitCommand("whoami")["client_login_name"] == "serveradmin"
+
+    #Likewise one that was never started.
+    api.submitCommandIter("clientdblist start=0 duration=50")
+    assert api.submitCommand("whoami")["client_login_name"] == "serveradmin"
+
+def test_client_database_is_walked_a_page_at_a_time(server, api):
+    walked = list(api.iterClientDatabase(page_size=10))
+
+    assert [offset for (offset, client) in walked] == list(range(len(server.state.database)))
+    assert [int(client["cldbid"]) for (offset, client) in walked] == sorted(server.state.database)
+    assert all("count" not in client for (offset, client) in walked)
+
+    #Resuming part way picks up where we left off.
+    resumed = list(api.iterClientDatabase(page_size=10, start=25))
+    assert resumed == walked[25:]
+
+def test_client_database_since_filters(server, api):
+    since = sorted(entry["client_lastconnected"] for entry in server.state.database.values())[40]
+
+    walked = [int(client["cldbid"]) for (offset, client) in api.iterClientDatabase(page_size=10, since=since)]
+
+    assert walked == sorted(cldbid for (cldbid, entry) in server.state.database.items() if entry["client_lastconnected"] > since)
+
+def test_idempotent_command_is_retried_after_reconnecting(server, api):
+    dropConnections(server)
+
+    assert api.submitCommand("whoami")["client_login_name"] == "serveradmin"
+    assert api.is_Connected and api.is_Authenticated
+    assert len(server.sessions) == 1
+
+def test_pipeline_is_retried_after_reconnecting(server, api):
+    dropConnections(server)
+
+    results = api.submitCommands(["whoami", "serverinfo"])
+
+    assert results[0]["client_login_name"] == "serveradmin"
+    assert results[1]["virtualserver_maxclients"] == str(server.state.serverInfo()["virtualserver_maxclients"])
+
+def test_unsafe_command_is_raised_after_reconnecting(server, api):
+    clid = next(iter(server.state.online))
+    dropConnections(server)
+
+    with pytest.raises(ConnectionError):
+        api.submitCommand("clientkick clid=" + str(clid) + " reasonid=5")
+
+    #We reconnected all the same, and nobody was kicked behind our back.
+    assert clid in server.state.online
+    assert api.submitCommand("whoami")["client_login_name"] == "serveradmin"
+
+def test_dropped_connection_is_raised_without_auto_reconnect(server, api):
+    api.auto_reconnect = False
+    dropConnections(server)
+
+    with pytest.raises(OSError):
+        api.submitCommand("whoami")